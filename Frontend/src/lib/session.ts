@@ -0,0 +1,15 @@
+import axios from "axios";
+
+const SESSION_STORAGE_KEY = "bbp-session-id";
+
+// One backend session per browser tab, so parallel workshops don't share state
+export const getSessionId = (): string => {
+  let sessionId = sessionStorage.getItem(SESSION_STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = crypto.randomUUID();
+    sessionStorage.setItem(SESSION_STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+};
+
+axios.defaults.headers.common["X-Session-Id"] = getSessionId();
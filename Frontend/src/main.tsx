@@ -1,5 +1,6 @@
 import { createRoot } from 'react-dom/client'
 import App from './App.tsx'
 import './index.css'
+import './lib/session'
 
 createRoot(document.getElementById("root")!).render(<App />);
@@ -84,9 +84,15 @@ export default function LLMInterview() {
         setAnswer("")
         setIndex((prev) => prev + 1)
         setProgress(Math.round(((index + 1) / total) * 100))
-        setProcessUnderstanding(res.data.process_understanding || "")
-        setProcessRecommendation(res.data.process_recommendation || "")
+        setIsSubmitting(false)
         setShowRecommendation(true)
+        // The next question is returned first; understanding and recommendation may still be generating
+        const analysis =
+          res.data.process_understanding !== null && res.data.process_recommendation !== null
+            ? res.data
+            : (await axios.get("http://localhost:8000/process_analysis", { params: { wait: true } })).data
+        setProcessUnderstanding(analysis.process_understanding || "")
+        setProcessRecommendation(analysis.process_recommendation || "")
       }
     } catch (err) {
       console.error("Failed to submit answer", err)
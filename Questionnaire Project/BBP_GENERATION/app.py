@@ -25,7 +25,7 @@ if uploaded_file:
 
     if st.button("🚀 Generate BBP"):
         with st.spinner("Generating BBP..."):
-            bbp_text, diagram_map = generate_bbp_from_qa(qa_path)
+            bbp_text, diagram_map, _ = generate_bbp_from_qa(qa_path)
 
         if bbp_text:
             st.success("🎉 BBP generated!")
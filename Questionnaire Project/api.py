@@ -1,30 +1,101 @@
 import os
 import shutil
-from typing import List, Dict
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Response
+import json
+import time
+import asyncio
+from typing import List, Dict, Optional
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Response, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from docx import Document
 import uvicorn
 from pydantic import BaseModel
-from generate_bbp import generate_bbp_from_process_analysis
+from generate_bbp import agenerate_bbp_from_process_analysis, astream_bbp_from_process_analysis, BBP_MODE, BBP_MODES
 from save_conversation import save_conversation_to_excel, save_conversation_to_word
 from save_analysis import save_individual_and_combined_analysis
-from extract_subprocesses import extract_subprocesses
-from vector_utils import build_rag_context
-from generate_questions import generate_suggested_questions
+from extract_subprocesses import aextract_subprocesses
+from vector_utils import build_subprocess_rag_context, precompute_subprocess_embeddings
+from vectorstore_registry import registry_stats
+from llm_cache import get_llm_cache
+from diagram_cache import get_diagram_cache
+from section_cache import get_section_cache
+from renderer import get_mermaid_worker
+from generate_questions import agenerate_suggested_questions
+from generate_followups import aplan_followups
 from BBP_GENERATION.generate_bbp import generate_bbp_from_qa
 from process_analysis import (
-    generate_process_understanding,
-    revise_process_understanding,
-    generate_process_recommendation,
-    revise_process_recommendation
+    aupdate_process_understanding,
+    arevise_process_understanding,
+    agenerate_process_recommendation,
+    arevise_process_recommendation,
+    astream_update_process_understanding,
+    astream_process_recommendation
 )
-from user_choices import current_user_choices
+from session_store import Session, session_store, resolve_session_id, SESSION_HEADER, SESSION_COOKIE
+from question_prefetch import question_prefetcher
+from token_accounting import token_ledger, current_session_id, current_endpoint
+from metrics import REQUEST_LATENCY, register_gauge, render_metrics
 
 load_dotenv(dotenv_path="local.env", override=True)
 
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", 90))
+
+def answered_history(session: Session) -> list:
+    """The answered Q&A entries of every subprocess so far, which both analyses cover."""
+    return list(session.choices.get("conversation_map", {}).values())
+
+async def _understanding_updates(session: Session, history: list) -> dict:
+    # Merges only the answers added since the last update, across all subprocesses
+    understanding, state = await aupdate_process_understanding(
+        answered_history(session),
+        session.choices.get("current_process_understanding", ""),
+        session.choices.get("understanding_state"),
+    )
+    return {"current_process_understanding": understanding, "understanding_state": state}
+
+async def _recommendation_updates(session: Session, history: list) -> dict:
+    # Recommends from the whole interview, the same scope as the understanding
+    return {"current_process_recommendation": await agenerate_process_recommendation(answered_history(session))}
+
+# User-choices field -> coroutine returning the choices to update
+ANALYSIS_FIELDS = {
+    "current_process_understanding": _understanding_updates,
+    "current_process_recommendation": _recommendation_updates,
+}
+def _stream_understanding(session: Session) -> tuple:
+    # Same incremental path as _understanding_updates; the new state is stored with the text
+    chunks, state = astream_update_process_understanding(
+        answered_history(session),
+        session.choices.get("current_process_understanding", ""),
+        session.choices.get("understanding_state"),
+    )
+    return chunks, {"understanding_state": state}
+
+def _stream_recommendation(session: Session) -> tuple:
+    return astream_process_recommendation(answered_history(session)), {}
+
+# User-choices field -> function returning (text chunks, other choices to store with the text)
+STREAM_FIELDS = {
+    "current_process_understanding": _stream_understanding,
+    "current_process_recommendation": _stream_recommendation,
+}
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# A prefetched question belongs to its session
+session_store.on_evict(question_prefetcher.discard)
+
+# Scrape-time gauges for /metrics
+register_gauge("bbp_sessions", "Sessions held in memory, and those with a request in progress.",
+               lambda: {(state,): session_store.stats()[state] for state in ("sessions", "active")}, ("state",))
+register_gauge("bbp_session_evictions", "Sessions evicted since start.",
+               lambda: {(): session_store.stats()["evictions"]})
+register_gauge("bbp_cache_hit_ratio", "Hit ratio of the LLM response, diagram and BBP section caches and the question prefetcher.",
+               lambda: {("llm_response",): get_llm_cache().stats()["hit_ratio"],
+                        ("diagram",): get_diagram_cache().stats()["hit_ratio"],
+                        ("bbp_section",): get_section_cache().stats()["hit_ratio"],
+                        ("question_prefetch",): question_prefetcher.stats()["hit_ratio"]}, ("cache",))
+
 app = FastAPI(
     title="SAP BBP Discovery Assistant API",
     description="API backend for SAP Ariba BBP process understanding and recommendation",
@@ -37,8 +108,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[SESSION_HEADER],
 )
 
+@app.middleware("http")
+async def track_request_context(request: Request, call_next):
+    # Lets the token ledger attribute LLM calls to the session and endpoint
+    session_token = current_session_id.set(
+        resolve_session_id(request.headers.get(SESSION_HEADER), request.cookies.get(SESSION_COOKIE))
+    )
+    endpoint_token = current_endpoint.set(request.url.path)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template keeps label cardinality bounded; streams are timed to their first byte
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, request.method,
+                                getattr(route, "path", "unmatched"), str(status))
+        current_endpoint.reset(endpoint_token)
+        current_session_id.reset(session_token)
+
 class ProcessUnderstandingFeedback(BaseModel):
     user_input: str
 
@@ -48,31 +141,113 @@ class RecommendationFeedback(BaseModel):
 class AnswerPayload(BaseModel):
     answer: str
 
+class FollowupRequest(BaseModel):
+    sub_process: Optional[str] = None  # defaults to the most recently answered subprocess
+
+class FollowupAnswerPayload(BaseModel):
+    question: str
+    answer: str
+    sub_process: Optional[str] = None
+
+def get_session(request: Request, response: Response) -> Session:
+    """Resolves the caller's session from the X-Session-Id header or the session cookie."""
+    session_id = resolve_session_id(request.headers.get(SESSION_HEADER), request.cookies.get(SESSION_COOKIE))
+    response.headers[SESSION_HEADER] = session_id
+    return session_store.get(session_id)
+
+async def locked_session(session: Session = Depends(get_session)):
+    """Like get_session, but holds the session lock for the whole request."""
+    async with session:
+        yield session
+
+async def _run_analysis(session: Session, field: str, generator, history: list, version: int):
+    """Generates one analysis field and stores it unless a newer answer superseded it."""
+    try:
+        updates = await asyncio.wait_for(generator(session, history), LLM_CALL_TIMEOUT_SECONDS)
+        if version == session.analysis_version:
+            session.choices.update(updates)
+            session.analysis_status[field] = "ready"
+            session_store.save(session)
+    except asyncio.TimeoutError:
+        if version == session.analysis_version:
+            session.analysis_status[field] = "timeout"
+    except Exception as e:
+        if version == session.analysis_version:
+            session.analysis_status[field] = f"failed: {e}"
+
+def start_analysis_tasks(session: Session, history: list):
+    """Starts understanding and recommendation generation concurrently in the background."""
+    session.analysis_version += 1
+    for field, generator in ANALYSIS_FIELDS.items():
+        session.analysis_status[field] = "pending"
+        session.analysis_tasks[field] = asyncio.create_task(
+            _run_analysis(session, field, generator, history, session.analysis_version)
+        )
+
+def supersede_analysis(session: Session, field: str):
+    """
+    Cancels the background generation of `field` so it cannot overwrite a revision stored
+    right after. Called on the event loop, so the task is cancelled before it can resume.
+    """
+    task = session.analysis_tasks.pop(field, None)
+    if task is not None and not task.done():
+        task.cancel()
+    session.analysis_status[field] = "ready"
+
+def prefetch_next_question(session: Session):
+    """Prefetches the opening question of the next incomplete subprocess after the current one."""
+    choices = session.choices
+    current = choices["current_subprocess"]
+    upcoming = [
+        sp for sp in choices["subprocess_list"]
+        if sp != current and choices["subprocess_states"].get(sp) != "completed"
+    ]
+    if upcoming:
+        question_prefetcher.start(session.session_id, upcoming[0], choices)
+    else:
+        question_prefetcher.discard(session.session_id)
+
+def analysis_snapshot(session: Session) -> dict:
+    """Returns the analysis fields that are ready (None while pending) plus their status."""
+    status = {field: session.analysis_status.get(field, "ready") for field in ANALYSIS_FIELDS}
+    return {
+        "process_understanding": session.choices["current_process_understanding"]
+        if status["current_process_understanding"] == "ready" else None,
+        "process_recommendation": session.choices["current_process_recommendation"]
+        if status["current_process_recommendation"] == "ready" else None,
+        "analysis_status": status,
+    }
+
 @app.get("/init_subprocess_flow")
-async def init_subprocess_flow():
+async def init_subprocess_flow(session: Session = Depends(locked_session)):
+    choices = session.choices
     try:
-        subprocesses = extract_subprocesses()
+        subprocesses = await aextract_subprocesses()
         if not subprocesses:
             raise HTTPException(status_code=404, detail="No subprocesses found")
 
-        current_user_choices["subprocess_list"] = subprocesses
-        current_user_choices["current_subprocess"] = subprocesses[0]
-        current_user_choices["subprocess_states"] = {sp: "incomplete" for sp in subprocesses}
-        rag_context = build_rag_context()
-        current_user_choices["rag_context"] = rag_context
+        choices["subprocess_list"] = subprocesses
+        choices["current_subprocess"] = subprocesses[0]
+        choices["subprocess_states"] = {sp: "incomplete" for sp in subprocesses}
+        question_prefetcher.discard(session.session_id)
+        await asyncio.to_thread(precompute_subprocess_embeddings, subprocesses, choices)
+        rag_context = await asyncio.to_thread(build_subprocess_rag_context, subprocesses[0], choices)
+        choices["rag_context"] = rag_context
 
-        first_question = generate_suggested_questions(
-            user_choices=current_user_choices,
+        first_question = (await agenerate_suggested_questions(
+            user_choices=choices,
             sub_process_name=subprocesses[0],
             rag_context=rag_context,
             conversation_history=[]
-        )[0]
+        ))[0]
 
-        current_user_choices["conversation_history"] = [{
+        choices["conversation_history"] = [{
             "question": first_question,
             "answer": "",
-            "followups": []
+            "followups": [],
+            "subprocess": subprocesses[0]
         }]
+        prefetch_next_question(session)
 
         return {
             "current_subprocess": subprocesses[0],
@@ -87,128 +262,261 @@ async def init_subprocess_flow():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/submit_answer")
-async def submit_answer(payload: AnswerPayload):
+async def submit_answer(payload: AnswerPayload, session: Session = Depends(locked_session)):
+    choices = session.choices
     answer = payload.answer
     try:
-        history = current_user_choices.get("conversation_history", [])
-        rag_context = current_user_choices["rag_context"]
-        current_subprocess = current_user_choices["current_subprocess"]
+        history = choices.get("conversation_history", [])
+        current_subprocess = choices["current_subprocess"]
 
         if not history:
             raise HTTPException(status_code=400, detail="No conversation history found.")
 
         history[-1]["answer"] = answer
 
-        if "conversation_map" not in current_user_choices:
-            current_user_choices["conversation_map"] = {}
-        current_user_choices["conversation_map"][current_subprocess] = history[-1]
-        current_user_choices["subprocess_states"][current_subprocess] = "completed"
+        if "conversation_map" not in choices:
+            choices["conversation_map"] = {}
+        choices["conversation_map"][current_subprocess] = history[-1]
+        choices["subprocess_states"][current_subprocess] = "completed"
 
-        current_user_choices["current_process_understanding"] = generate_process_understanding(history)
-        current_user_choices["current_process_recommendation"] = generate_process_recommendation(history)
+        # Understanding, recommendation and the next question are independent: run them concurrently
+        start_analysis_tasks(session, history)
 
         all_completed = all(
             state == "completed"
-            for state in current_user_choices["subprocess_states"].values()
+            for state in choices["subprocess_states"].values()
         )
 
         if all_completed:
+            question_prefetcher.discard(session.session_id)
+            await asyncio.gather(*session.analysis_tasks.values())
             return {
                 "status": "completed_all",
                 "message": "All subprocesses completed.",
-                "process_understanding": current_user_choices["current_process_understanding"],
-                "process_recommendation": current_user_choices["current_process_recommendation"],
+                **analysis_snapshot(session),
                 "all_completed": True
             }
 
         remaining = [
-            sp for sp in current_user_choices["subprocess_list"]
-            if current_user_choices["subprocess_states"].get(sp) != "completed"
+            sp for sp in choices["subprocess_list"]
+            if choices["subprocess_states"].get(sp) != "completed"
         ]
         next_subprocess = remaining[0]
-        current_user_choices["current_subprocess"] = next_subprocess
-
-        followups = generate_suggested_questions(
-            user_choices=current_user_choices,
-            sub_process_name=next_subprocess,
-            rag_context=rag_context,
-            conversation_history=[]
-        )
+        choices["current_subprocess"] = next_subprocess
+
+        # The prefetch wait and a fallback generation share one LLM_CALL_TIMEOUT_SECONDS budget
+        deadline = time.monotonic() + LLM_CALL_TIMEOUT_SECONDS
+        prefetched = await question_prefetcher.take(session.session_id, next_subprocess, LLM_CALL_TIMEOUT_SECONDS)
+        if prefetched:
+            rag_context, followups = prefetched
+        else:
+            rag_context = await asyncio.to_thread(build_subprocess_rag_context, next_subprocess, choices)
+            try:
+                followups = await asyncio.wait_for(agenerate_suggested_questions(
+                    user_choices=choices,
+                    sub_process_name=next_subprocess,
+                    rag_context=rag_context,
+                    conversation_history=[]
+                ), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="Timed out generating the next question.")
+        choices["rag_context"] = rag_context
         next_question = followups[0] if followups else "[No further questions generated]"
 
-        current_user_choices["conversation_history"] = [{
+        choices["conversation_history"] = [{
             "question": next_question,
             "answer": "",
-            "followups": []
+            "followups": [],
+            "subprocess": next_subprocess
         }]
+        prefetch_next_question(session)
 
         return {
             "status": "continue",
             "next_question": next_question,
             "current_subprocess": next_subprocess,
-            "process_understanding": current_user_choices["current_process_understanding"],
-            "process_recommendation": current_user_choices["current_process_recommendation"],
+            **analysis_snapshot(session),
             "all_completed": False
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def answered_entry(session: Session, sub_process: str = None) -> tuple:
+    """Returns (subprocess, Q&A entry) of a subprocess, or of the most recently answered one."""
+    conversation_map = session.choices.get("conversation_map", {})
+    if sub_process is None and conversation_map:
+        sub_process = list(conversation_map)[-1]
+    entry = conversation_map.get(sub_process)
+    if not entry or not entry.get("answer"):
+        raise HTTPException(status_code=400, detail="No answered question to follow up on.")
+    return sub_process, entry
+
+@app.post("/generate_followups")
+async def generate_followups_endpoint(payload: FollowupRequest = Body(default=None), session: Session = Depends(locked_session)):
+    """
+    Returns ranked follow-up candidates and a stop decision from a single LLM call;
+    the client pages through them and posts each answer to /submit_followup_answer.
+    """
+    sub_process, entry = answered_entry(session, payload.sub_process if payload else None)
+    rag_context = await asyncio.to_thread(build_subprocess_rag_context, sub_process, session.choices)
+    try:
+        plan = await asyncio.wait_for(aplan_followups(
+            question=entry["question"],
+            answer=entry["answer"],
+            rag_context=rag_context,
+            conversation_history=[entry],
+            prior_followups=entry.get("followups", [])
+        ), LLM_CALL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out generating follow-ups.")
+    return {"sub_process": sub_process, "followups": plan.followups, "stop": plan.stop, "reason": plan.reason}
+
+@app.post("/submit_followup_answer")
+async def submit_followup_answer(payload: FollowupAnswerPayload, session: Session = Depends(locked_session)):
+    sub_process, entry = answered_entry(session, payload.sub_process)
+    entry.setdefault("followups", []).append({"question": payload.question, "answer": payload.answer})
+    return {"status": "saved", "sub_process": sub_process, "followups": len(entry["followups"])}
+
+@app.get("/process_analysis")
+async def get_process_analysis(wait: bool = False, session: Session = Depends(get_session)):
+    """
+    Returns the latest understanding and recommendation. With wait=true, blocks until
+    the generations started by the last /submit_answer have finished.
+    """
+    if wait and session.analysis_tasks:
+        # A generation superseded by a revision is cancelled; wait for the others regardless
+        await asyncio.gather(*session.analysis_tasks.values(), return_exceptions=True)
+    return analysis_snapshot(session)
+
 @app.post("/revise_process_understanding")
-async def revise_process_understanding_endpoint(payload: ProcessUnderstandingFeedback):
+async def revise_process_understanding_endpoint(payload: ProcessUnderstandingFeedback, session: Session = Depends(locked_session)):
+    choices = session.choices
     try:
-        history = current_user_choices.get("conversation_history", [])
-        current_summary = current_user_choices.get("current_process_understanding", "")
+        history = choices.get("conversation_history", [])
+        current_summary = choices.get("current_process_understanding", "")
         user_input = payload.user_input
 
-        revised_summary = revise_process_understanding(
+        revised_summary = await arevise_process_understanding(
             conversation_history=history,
             user_input=user_input,
             current_understanding=current_summary
         )
-        current_user_choices["current_process_understanding"] = revised_summary
+        supersede_analysis(session, "current_process_understanding")
+        choices["current_process_understanding"] = revised_summary
         return {"updated_process_understanding": revised_summary}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/revise_process_recommendation")
-async def revise_process_recommendation_endpoint(payload: RecommendationFeedback):
+async def revise_process_recommendation_endpoint(payload: RecommendationFeedback, session: Session = Depends(locked_session)):
+    choices = session.choices
     try:
-        current_rec = current_user_choices.get("current_process_recommendation", "")
+        current_rec = choices.get("current_process_recommendation", "")
         user_input = payload.user_input
         if not current_rec:
             raise HTTPException(status_code=400, detail="No recommendation to revise.")
-        updated_rec = revise_process_recommendation(user_input, current_rec)
-        current_user_choices["current_process_recommendation"] = updated_rec
+        updated_rec = await arevise_process_recommendation(user_input, current_rec)
+        supersede_analysis(session, "current_process_recommendation")
+        choices["current_process_recommendation"] = updated_rec
         return {"updated_process_recommendation": updated_rec}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/generate_bbp_from_process_analysis")
-async def generate_bbp_from_process_analysis_endpoint():
+async def generate_bbp_from_process_analysis_endpoint(mode: str = BBP_MODE, session: Session = Depends(get_session)):
+    """`mode` is "single" (one completion) or "sections" (sections generated concurrently)."""
+    if mode not in BBP_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}' (use one of {', '.join(BBP_MODES)}).")
+    choices = session.choices
     try:
-        process_understanding = current_user_choices.get("current_process_understanding", "")
-        process_recommendation = current_user_choices.get("current_process_recommendation", "")
+        process_understanding = choices.get("current_process_understanding", "")
+        process_recommendation = choices.get("current_process_recommendation", "")
         if not process_understanding or not process_recommendation:
             raise HTTPException(status_code=400, detail="Missing content.")
-        bbp_content, image_map = generate_bbp_from_process_analysis(
+        bbp_content, image_map, diagrams = await agenerate_bbp_from_process_analysis(
             process_understanding=process_understanding,
-            process_recommendation=process_recommendation
+            process_recommendation=process_recommendation,
+            mode=mode
         )
-        return {"bbp_content": bbp_content, "image_map": image_map}
+        return {"bbp_content": bbp_content, "image_map": image_map, "diagrams": diagrams}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"BBP generation failed: {str(e)}")
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_analysis(session: Session, field: str) -> StreamingResponse:
+    """
+    Streams one analysis field as server-sent "token" events, then stores the full text
+    with its analysis state (unless a newer answer started a fresh generation) and sends
+    a "done" event. Like the background analyses, it covers every answered subprocess.
+    """
+    if not answered_history(session):
+        raise HTTPException(status_code=400, detail="No answered questions found.")
+    version = session.analysis_version
+    chunks, updates = STREAM_FIELDS[field](session)
+
+    async def events():
+        parts = []
+        try:
+            async for text in chunks:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+            return
+        result = "".join(parts).strip()
+        if version == session.analysis_version:
+            session.choices[field] = result
+            session.choices.update(updates)
+            session.analysis_status[field] = "ready"
+            session_store.save(session)
+        yield sse_event("done", {"text": result})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/stream/process_understanding")
+async def stream_process_understanding(session: Session = Depends(get_session)):
+    return stream_analysis(session, "current_process_understanding")
+
+@app.get("/stream/process_recommendation")
+async def stream_process_recommendation(session: Session = Depends(get_session)):
+    return stream_analysis(session, "current_process_recommendation")
+
+@app.get("/stream/generate_bbp_from_process_analysis")
+async def stream_bbp_from_process_analysis(mode: str = BBP_MODE, session: Session = Depends(get_session)):
+    """
+    Streams BBP generation: "token" events while the text is generated (whole sections
+    in "sections" mode), "diagram" events as each Mermaid diagram finishes rendering,
+    then "document" and "done".
+    """
+    if mode not in BBP_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}' (use one of {', '.join(BBP_MODES)}).")
+    process_understanding = session.choices.get("current_process_understanding", "")
+    process_recommendation = session.choices.get("current_process_recommendation", "")
+    if not process_understanding or not process_recommendation:
+        raise HTTPException(status_code=400, detail="Missing content.")
+
+    async def events():
+        async for event, data in astream_bbp_from_process_analysis(process_understanding, process_recommendation, mode):
+            yield sse_event(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.get("/export_qna_excel")
-async def export_qna_excel():
+async def export_qna_excel(session: Session = Depends(get_session)):
+    choices = session.choices
     try:
-        qna_map = current_user_choices.get("conversation_map", {})
+        qna_map = choices.get("conversation_map", {})
         if not qna_map:
             raise HTTPException(status_code=400, detail="No Q&A data.")
         for subprocess, entry in qna_map.items():
             if not entry.get("answer"):
                 continue
-            save_conversation_to_excel(subprocess, entry)
+            await asyncio.to_thread(save_conversation_to_excel, subprocess, entry)
         return {
             "status": "excel_export_successful",
             "excel_path": "output/conversation_log.xlsx",
@@ -218,12 +526,13 @@ async def export_qna_excel():
         raise HTTPException(status_code=500, detail=f"Failed to export Excel: {str(e)}")
 
 @app.get("/export_qna_word")
-async def export_qna_word():
+async def export_qna_word(session: Session = Depends(get_session)):
+    choices = session.choices
     try:
-        qna_map = current_user_choices.get("conversation_map", {})
+        qna_map = choices.get("conversation_map", {})
         if not qna_map:
             raise HTTPException(status_code=400, detail="No Q&A data.")
-        save_conversation_to_word(qna_map)
+        await asyncio.to_thread(save_conversation_to_word, qna_map)
         return {
             "status": "word_export_successful",
             "word_path": "output/qna_combined.docx",
@@ -233,13 +542,14 @@ async def export_qna_word():
         raise HTTPException(status_code=500, detail=f"Failed to export Word doc: {str(e)}")
 
 @app.get("/export_process_analysis_docs")
-async def export_process_analysis_docs():
+async def export_process_analysis_docs(session: Session = Depends(get_session)):
+    choices = session.choices
     try:
-        pu = current_user_choices.get("current_process_understanding", "")
-        pr = current_user_choices.get("current_process_recommendation", "")
+        pu = choices.get("current_process_understanding", "")
+        pr = choices.get("current_process_recommendation", "")
         if not pu and not pr:
             raise HTTPException(status_code=400, detail="Missing content.")
-        pu_path, pr_path, combined_path = save_individual_and_combined_analysis(pu, pr)
+        pu_path, pr_path, combined_path = await asyncio.to_thread(save_individual_and_combined_analysis, pu, pr)
         return {
             "status": "export_successful",
             "files": {
@@ -256,7 +566,7 @@ async def upload_file(file: UploadFile = File(...)):
     save_path = "BBP_Generation/uploads/qa_input.docx"
     with open(save_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
-    generate_bbp_from_qa()
+    await asyncio.to_thread(generate_bbp_from_qa)
     return Response(status_code=204)
 
 @app.get("/get_bbp_document")
@@ -265,7 +575,7 @@ async def get_bbp_document():
         path = os.path.abspath("BBP_GENERATION/output/generated_bbp.docx")
         if not os.path.exists(path):
             raise HTTPException(status_code=404, detail="BBP document not found")
-        doc = Document(path)
+        doc = await asyncio.to_thread(Document, path)
         full_text = "\n\n".join([para.text for para in doc.paragraphs if para.text.strip()])
         return {"content": full_text}
     except Exception as e:
@@ -274,32 +584,32 @@ async def get_bbp_document():
 
 
 @app.post("/update_sap_product")
-async def update_sap_product(product: str = Body(...)):
+async def update_sap_product(product: str = Body(...), session: Session = Depends(locked_session)):
     try:
-        current_user_choices["product"] = product
+        session.choices["product"] = product
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_module")
-async def update_module(module: str = Body(...)):
+async def update_module(module: str = Body(...), session: Session = Depends(locked_session)):
     try:
-        current_user_choices["module"] = module
+        session.choices["module"] = module
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_activity")
-async def update_activity(activity: str = Body(...)):
+async def update_activity(activity: str = Body(...), session: Session = Depends(locked_session)):
     try:
-        current_user_choices["activity"] = activity
+        session.choices["activity"] = activity
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
 @app.post("/update_customer_context")
-async def update_customer_context(payload: Dict[str, Dict[str, str]]):
+async def update_customer_context(payload: Dict[str, Dict[str, str]], session: Session = Depends(locked_session)):
     try:
         context = payload.get("context", {})
         for key, value in context.items():
-            current_user_choices[key] = value
+            session.choices[key] = value
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
@@ -308,5 +618,39 @@ async def update_customer_context(payload: Dict[str, Dict[str, str]]):
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, stage and cache metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/vectorstore_stats")
+async def vectorstore_stats():
+    return await asyncio.to_thread(registry_stats)
+
+@app.get("/prefetch_stats")
+async def prefetch_stats():
+    return question_prefetcher.stats()
+
+@app.get("/session_stats")
+async def session_stats():
+    return session_store.stats()
+
+@app.get("/token_report")
+async def token_report(session_id: str = None, recent: int = 20):
+    """Token usage per call, rolled up per caller, endpoint and session."""
+    return token_ledger.report(session_id=session_id, recent=recent)
+
+@app.get("/llm_cache_stats")
+async def llm_cache_stats():
+    return get_llm_cache().stats()
+
+@app.get("/diagram_stats")
+async def diagram_stats():
+    return {"cache": get_diagram_cache().stats(), "worker": get_mermaid_worker().stats()}
+
+@app.get("/bbp_section_stats")
+async def bbp_section_stats():
+    return get_section_cache().stats()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
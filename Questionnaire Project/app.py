@@ -1,10 +1,10 @@
 import streamlit as st
 from generate_suggested_questions import generate_suggested_questions
-from generate_followups import generate_next_followup
-from vector_utils import build_rag_context
+from generate_followups import plan_followups
+from vector_utils import build_subprocess_rag_context, precompute_subprocess_embeddings
 from extract_subprocesses import extract_subprocesses
 from user_choices import current_user_choices
-from process_analysis import generate_process_understanding, revise_process_understanding, generate_process_recommendation, revise_process_recommendation
+from process_analysis import update_process_understanding, revise_process_understanding, generate_process_recommendation, revise_process_recommendation
 
 # Page config
 st.set_page_config(page_title="SAP BBP Discovery Assistant", layout="wide")
@@ -16,6 +16,7 @@ if "conversation_history" not in st.session_state:
     st.session_state.current_question = ""
     st.session_state.step = "question"
     st.session_state.process_understanding = ""
+    st.session_state.understanding_state = {}
     st.session_state.process_recommendation = ""
     st.session_state.followup_index = 0
     st.session_state.followup_questions = []
@@ -24,14 +25,11 @@ if "conversation_history" not in st.session_state:
 if "subprocess_list" not in st.session_state:
     st.session_state.subprocess_list = extract_subprocesses()
     st.session_state.current_subprocess_index = 0
+    precompute_subprocess_embeddings(st.session_state.subprocess_list, current_user_choices)
 
 if "selected_subprocess" not in st.session_state:
     st.session_state.selected_subprocess = st.session_state.subprocess_list[0]
 
-if "rag_context" not in st.session_state or not st.session_state.rag_context:
-    with st.spinner("Loading documents and building context..."):
-        st.session_state.rag_context = build_rag_context()
-
 # View subprocess list
 with st.expander("📄 View All Sub-Processes"):
     for idx, sp in enumerate(st.session_state.subprocess_list, 1):
@@ -40,6 +38,7 @@ with st.expander("📄 View All Sub-Processes"):
 # Step 1: Generate Suggested Question
 if st.session_state.step == "question":
     st.session_state.selected_subprocess = st.session_state.subprocess_list[st.session_state.current_subprocess_index]
+    st.session_state.rag_context = build_subprocess_rag_context(st.session_state.selected_subprocess, current_user_choices)
     with st.spinner("Generating suggested question..."):
         suggested = generate_suggested_questions(
             user_choices=current_user_choices,
@@ -81,25 +80,28 @@ if st.session_state.step == "await_answer":
                 st.session_state.conversation_history.append({
                     "question": st.session_state.current_question,
                     "answer": main_answer,
-                    "followups": []
+                    "followups": [],
+                    "subprocess": st.session_state.selected_subprocess
                 })
 
                 # Update Process Understanding
                 with st.spinner("🔍 Updating Process Understanding..."):
                     convo = st.session_state.conversation_history
-                    st.session_state.process_understanding = generate_process_understanding(convo)
+                    st.session_state.process_understanding, st.session_state.understanding_state = update_process_understanding(
+                        convo, st.session_state.process_understanding, st.session_state.understanding_state
+                    )
 
-                # Generate first follow-up
-                with st.spinner("⏳ Generating follow-up question..."):
-                    first_fup = generate_next_followup(
+                # Plan all follow-ups in one call; they are paged through locally
+                with st.spinner("⏳ Generating follow-up questions..."):
+                    plan = plan_followups(
                         question=st.session_state.current_question,
                         answer=main_answer,
-                        prior_followups=[],
                         rag_context=st.session_state.rag_context,
                         conversation_history=st.session_state.conversation_history
                     )
-                    if first_fup:
-                        st.session_state.followup_questions.append({"question": first_fup, "answer": ""})
+                    st.session_state.followup_questions = [{"question": q, "answer": ""} for q in plan.followups]
+                if not st.session_state.followup_questions:
+                    st.session_state.step = "summary"
 
                 st.rerun()
 
@@ -136,31 +138,10 @@ if st.session_state.step == "followups":
             st.session_state.conversation_history[-1]["followups"].append(current_fup)
             st.session_state.followup_index += 1
 
-            # Generate next follow-up
-            with st.spinner("🔍 Checking for more follow-ups..."):
-                next_fup = generate_next_followup(
-                    question=st.session_state.current_question,
-                    answer=st.session_state.temp_main_answer,
-                    prior_followups=st.session_state.conversation_history[-1]["followups"],
-                    rag_context=st.session_state.rag_context,
-                    conversation_history=st.session_state.conversation_history
-                )
-
-                if next_fup:
-                    st.session_state.followup_questions.append({"question": next_fup, "answer": ""})
-                    st.rerun()
-                else:
-                    st.markdown("✅ All follow-up questions complete.")
-
-                    if st.button("➡️ Next Sub-Process"):
-                        st.session_state.current_subprocess_index += 1
-                        st.session_state.step = "question"
-                        st.session_state.followup_index = 0
-                        st.session_state.followup_questions = []
-                        st.session_state.temp_main_answer = ""
-                        for i in range(10):
-                            st.session_state.pop(f"fup_answer_{i}", None)
-                        st.rerun()
+            # Show the next planned follow-up, or finish the sub-process
+            if st.session_state.followup_index >= len(st.session_state.followup_questions):
+                st.session_state.step = "summary"
+            st.rerun()
 
 
 # Step 4: Final Review and Next Subprocess
@@ -1,17 +1,22 @@
 import os
+import hashlib
 import logging
+import threading
 import traceback
 from dotenv import load_dotenv
 
-from langchain_ollama import OllamaEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
 
 
 
 load_dotenv(dotenv_path=".env", override=True)
 
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-os.environ["HUGGINGFACE_API_KEY"] = os.getenv("HUGGINGFACE_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "ollama")
+STUB_EMBEDDING_SIZE = 768
 logger = logging.getLogger(__name__)
 
 
@@ -20,25 +25,93 @@ logger = logging.getLogger(__name__)
 class Model:
     def llm(self):
         try:
+            from langchain_google_genai import ChatGoogleGenerativeAI
             return ChatGoogleGenerativeAI(
     model="gemini-2.5-flash",
 )
 
-                
-            
+
+
         except Exception as e:
             raise Exception(f"LLM Init Error: {e}\n{traceback.format_exc()}")
 
-    
+
 
     def embedding(self):
         try:
+            from langchain_ollama import OllamaEmbeddings
             return OllamaEmbeddings(model="nomic-embed-text")  # or any local embedding model you've pulled
         except Exception as e:
             raise Exception(f"Embedding Init Error: {e}\n{traceback.format_exc()}")
 
 
+class StubChatModel(BaseChatModel):
+    """Deterministic offline chat model: the reply depends only on the prompt text."""
+
+    model: str = "stub-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        content = "\n".join(f"{i}. Stub response {i} [{digest}]" for i in range(1, 4))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
 
 mode_instance = Model()
-llm_instance = mode_instance.llm() 
-embeddings_instance = mode_instance.embedding()
+
+# Provider name -> zero-argument factory
+LLM_PROVIDERS = {
+    "gemini": mode_instance.llm,
+    "stub": StubChatModel,
+}
+EMBEDDING_PROVIDERS = {
+    "ollama": mode_instance.embedding,
+    "stub": lambda: DeterministicFakeEmbedding(size=STUB_EMBEDDING_SIZE),
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def register_llm_provider(name: str, factory):
+    """Registers a zero-argument factory returning a LangChain chat model."""
+    LLM_PROVIDERS[name] = factory
+
+
+def register_embedding_provider(name: str, factory):
+    """Registers a zero-argument factory returning a LangChain Embeddings instance."""
+    EMBEDDING_PROVIDERS[name] = factory
+
+
+def _get_client(kind: str, providers: dict, name: str):
+    key = (kind, name)
+    with _clients_lock:
+        if key not in _clients:
+            if name not in providers:
+                raise Exception(f"Unknown {kind} provider '{name}'. Available: {sorted(providers)}")
+            _clients[key] = providers[name]()
+            logger.info("Initialized %s provider '%s'", kind, name)
+        return _clients[key]
+
+
+def get_llm(provider: str = None):
+    """Returns the cached chat model of a provider (LLM_PROVIDER by default), built on first use."""
+    return _get_client("llm", LLM_PROVIDERS, provider or LLM_PROVIDER)
+
+
+def get_embeddings(provider: str = None):
+    """Returns the cached embeddings client of a provider (EMBEDDING_PROVIDER by default)."""
+    return _get_client("embedding", EMBEDDING_PROVIDERS, provider or EMBEDDING_PROVIDER)
+
+
+def __getattr__(name):
+    # Backwards compatibility for `from core.models import llm_instance`
+    if name == "llm_instance":
+        return get_llm()
+    if name == "embeddings_instance":
+        return get_embeddings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,158 @@
+# diagram_cache.py
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+
+DIAGRAM_CACHE_ENABLED = os.getenv("DIAGRAM_CACHE_ENABLED", "1") != "0"
+DIAGRAM_CACHE_DIR = os.getenv("DIAGRAM_CACHE_DIR", os.path.join("cache", "diagrams"))
+DIAGRAM_CACHE_MAX_BYTES = int(os.getenv("DIAGRAM_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# Images used this recently are never evicted, so a BBP being assembled keeps its diagrams
+DIAGRAM_CACHE_MIN_AGE_SECONDS = float(os.getenv("DIAGRAM_CACHE_MIN_AGE_SECONDS", 300))
+
+
+def diagram_key(mermaid_code: str, options: dict) -> str:
+    """Content address of a rendered diagram: the Mermaid source plus the render options."""
+    payload = json.dumps({"code": mermaid_code.strip(), "options": options}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiagramCache:
+    """
+    Rendered diagrams stored as <key>.png in one directory. Renders go to a unique
+    temporary file that is renamed into place, so concurrent runs never see or
+    overwrite a partial image. Least recently used images are evicted once the
+    directory grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, min_age_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_age_seconds = min_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._rendering = {}  # key -> lock held while that diagram renders
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            os.utime(path)  # last use, for LRU eviction
+        except OSError:
+            return None
+        return path
+
+    def get_or_render(self, mermaid_code: str, options: dict, render) -> str:
+        """
+        Returns the cached image for this diagram, rendering it on a miss with
+        `render(mermaid_code, mmd_path, png_path)`. Concurrent misses for the same
+        diagram render it once.
+        """
+        key = diagram_key(mermaid_code, options)
+        path = self.get(key)
+        if path:
+            with self._lock:
+                self.hits += 1
+            return path
+
+        with self._lock:
+            key_lock = self._rendering.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                path = self.get(key)
+                if path:
+                    with self._lock:
+                        self.hits += 1
+                    return path
+                with self._lock:
+                    self.misses += 1
+
+                token = uuid.uuid4().hex
+                tmp_mmd = os.path.join(self.directory, f"{key}.{token}.tmp.mmd")
+                tmp_png = os.path.join(self.directory, f"{key}.{token}.tmp.png")
+                try:
+                    render(mermaid_code, tmp_mmd, tmp_png)
+                    os.replace(tmp_png, self.path(key))
+                finally:
+                    for tmp in (tmp_mmd, tmp_png):
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+            finally:
+                with self._lock:
+                    self._rendering.pop(key, None)
+
+        self.evict(keep=key)
+        return self.path(key)
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".png") or ".tmp." in name:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self, keep: str = None):
+        """Removes least recently used images until the directory fits in max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.min_age_seconds
+        for mtime, size, name in entries:
+            if total <= self.max_bytes or mtime > cutoff:
+                break
+            if name == f"{keep}.png":
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        for _, _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": DIAGRAM_CACHE_ENABLED,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_diagram_cache() -> DiagramCache:
+    """Returns the process-wide diagram cache, creating its directory on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiagramCache(DIAGRAM_CACHE_DIR, DIAGRAM_CACHE_MAX_BYTES, DIAGRAM_CACHE_MIN_AGE_SECONDS)
+        return _cache
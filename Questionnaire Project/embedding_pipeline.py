@@ -0,0 +1,136 @@
+# embedding_pipeline.py
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores.utils import filter_complex_metadata
+from core.models import get_embeddings, EMBEDDING_PROVIDER
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_TIMEOUT_SECONDS = float(os.getenv("EMBED_TIMEOUT_SECONDS", 120))
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+CHROMA_UPSERT_BATCH = 1000
+
+
+class BatchedOllamaEmbeddings(Embeddings):
+    """
+    Embeds texts through Ollama's /api/embed in fixed-size batches, sending up to
+    `concurrency` batches at once over a pooled keep-alive HTTP client.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        base_url: str = DEFAULT_OLLAMA_URL,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+        timeout: float = EMBED_TIMEOUT_SECONDS,
+    ):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self._client = httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+
+    def _embed_batch(self, texts: list) -> list:
+        response = self._client.post("/api/embed", json={"model": self.model, "input": texts})
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_documents(self, texts: list, batch_size: int = None, progress_callback=None) -> list:
+        """
+        Embeds texts in order. `progress_callback(done, total, chunks_per_sec)` is called
+        as each batch completes.
+        """
+        if not texts:
+            return []
+        batch_size = max(1, batch_size or self.batch_size)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        results = [None] * len(batches)
+        done = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+            futures = {pool.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                done += len(batches[i])
+                if progress_callback:
+                    elapsed = time.perf_counter() - start
+                    progress_callback(done, len(texts), done / elapsed if elapsed else 0.0)
+
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed_batch([text])[0]
+
+    def close(self):
+        self._client.close()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_embedding_pipeline():
+    """
+    Returns the process-wide batched embedder for the configured Ollama model, or the
+    provider's own embeddings client when EMBEDDING_PROVIDER is not Ollama.
+    """
+    global _pipeline
+    embeddings = get_embeddings()
+    if EMBEDDING_PROVIDER != "ollama":
+        return embeddings
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = BatchedOllamaEmbeddings(
+                model=embeddings.model,
+                base_url=getattr(embeddings, "base_url", None) or os.getenv("OLLAMA_BASE_URL", DEFAULT_OLLAMA_URL),
+            )
+        return _pipeline
+
+
+def print_progress(done: int, total: int, chunks_per_sec: float):
+    print(f"🧮 Embedded {done}/{total} chunks ({chunks_per_sec:.1f} chunks/sec)")
+
+
+def ingest_documents(vectorstore, documents: list, ids: list, batch_size: int = None, progress_callback=print_progress) -> dict:
+    """
+    Embeds documents with the batched pipeline and upserts them into a Chroma vectorstore.
+
+    Returns ingestion stats: chunk count, elapsed seconds and chunks/sec.
+    """
+    start = time.perf_counter()
+    if documents:
+        documents = filter_complex_metadata(documents)
+        texts = [doc.page_content for doc in documents]
+        embedder = get_embedding_pipeline()
+        if isinstance(embedder, BatchedOllamaEmbeddings):
+            vectors = embedder.embed_documents(texts, batch_size=batch_size, progress_callback=progress_callback)
+        else:
+            vectors = embedder.embed_documents(texts)
+        for i in range(0, len(documents), CHROMA_UPSERT_BATCH):
+            vectorstore._collection.upsert(
+                ids=ids[i:i + CHROMA_UPSERT_BATCH],
+                embeddings=vectors[i:i + CHROMA_UPSERT_BATCH],
+                metadatas=[doc.metadata for doc in documents[i:i + CHROMA_UPSERT_BATCH]],
+                documents=texts[i:i + CHROMA_UPSERT_BATCH],
+            )
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "chunks": len(documents),
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(len(documents) / elapsed, 1) if elapsed and documents else 0.0,
+    }
+    if documents:
+        print(f"✅ Ingested {stats['chunks']} chunks in {stats['seconds']}s ({stats['chunks_per_sec']} chunks/sec)")
+    return stats
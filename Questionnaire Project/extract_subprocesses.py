@@ -1,19 +1,21 @@
 # extract_subprocesses.py
 
-from core.models import llm_instance
-from vector_utils import load_documents, create_or_load_vectorstore
+import asyncio
+from llm_cache import cached_invoke, acached_invoke
+from vector_utils import create_or_load_vectorstore, VECTOR_DB_PATH
+from vectorstore_registry import get_retriever
+from metrics import track_stage
 
 NUM_SUBPROCESS_DOCS = 5
 
-def extract_subprocesses():
-    
-    """Uses RAG + LLM to extract subprocess names from sourcing documents."""
-    documents = load_documents()
-    vectorstore = create_or_load_vectorstore(documents)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": NUM_SUBPROCESS_DOCS})
+def subprocess_extraction_prompt() -> str:
+    """Retrieves sourcing context and builds the subprocess extraction prompt."""
+    create_or_load_vectorstore()
+    retriever = get_retriever(VECTOR_DB_PATH, k=NUM_SUBPROCESS_DOCS)
 
     query = "List the key subprocesses involved in an SAP Ariba Sourcing project."
-    docs = retriever.get_relevant_documents(query)
+    with track_stage("retrieval"):
+        docs = retriever.get_relevant_documents(query)
     context = "\n\n".join([doc.page_content for doc in docs])
 
     extraction_prompt = f"""
@@ -38,11 +40,11 @@ Do not provide descriptions or explanations.
 {context}
 --- CONTEXT END ---
 """
+    return extraction_prompt
 
-    response = llm_instance.invoke(extraction_prompt)
-
+def parse_subprocesses(content: str) -> list:
     subprocesses = []
-    for line in response.content.strip().split("\n"):
+    for line in content.strip().split("\n"):
         line = line.strip()
         # Keep only lines that start with a number (subprocess lines)
         if not line or not any(char.isdigit() for char in line[:3]):
@@ -54,6 +56,18 @@ Do not provide descriptions or explanations.
 
     return subprocesses
 
+def extract_subprocesses():
+    
+    """Uses RAG + LLM to extract subprocess names from sourcing documents."""
+    response = cached_invoke(subprocess_extraction_prompt())
+    return parse_subprocesses(response.content)
+
+async def aextract_subprocesses():
+    """Async variant of extract_subprocesses; retrieval runs in a worker thread."""
+    extraction_prompt = await asyncio.to_thread(subprocess_extraction_prompt)
+    response = await acached_invoke(extraction_prompt)
+    return parse_subprocesses(response.content)
+
 if __name__ == "__main__":
     subprocesses = extract_subprocesses()
     print("✅ Extracted Subprocesses:")
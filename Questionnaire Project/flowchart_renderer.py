@@ -0,0 +1,682 @@
+# flowchart_renderer.py
+#
+# Browser-free renderer for the Mermaid flowchart subset the BBP prompts produce:
+# `graph`/`flowchart` with a direction, nodes with the common shapes, and solid,
+# dotted and thick links with optional labels. Anything else raises UnsupportedDiagram
+# so the caller can fall back to mermaid-cli.
+
+import os
+import re
+import math
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+# Bump when the drawing changes, so cached images are rendered again
+NATIVE_RENDERER_VERSION = 1
+
+FONT_SIZE = 14
+LINE_HEIGHT = 1.4
+WRAP_WIDTH = 200
+NODE_PADDING_X = 15
+NODE_PADDING_Y = 10
+NODE_SPACING = 50
+DUMMY_SPACING = 15
+RANK_SPACING = 50
+LABEL_PADDING = 4
+MARGIN = 10
+ARROW_LENGTH = 9
+ARROW_WIDTH = 8
+ORDER_SWEEPS = 4
+SUPERSAMPLE = 2
+FONT_FILES = ("DejaVuSans.ttf", "Arial.ttf", "arial.ttf", "LiberationSans-Regular.ttf")
+FONT_FAMILY = "trebuchet ms, verdana, arial, sans-serif"
+# Mermaid's default theme
+COLORS = {"fill": "#ECECFF", "stroke": "#9370DB", "edge": "#333333", "text": "#333333", "label": "#E8E8E8"}
+EDGE_WIDTHS = {"solid": 1.5, "dotted": 1.5, "thick": 3.5}
+
+HEADER_RE = re.compile(r"^(?:graph|flowchart)(?:\s+(TB|TD|BT|RL|LR))?$", re.IGNORECASE)
+NODE_ID_RE = re.compile(r"[A-Za-z0-9_]+")
+ARROW_RE = re.compile(r"(-{2,}>|-{3,}|-\.+->|-\.+-|={2,}>|={3,})\s*(?:\|([^|]*)\|)?")
+TEXT_ARROW_RE = re.compile(r"(--|-\.|==)\s+(.+?)\s+(-{2,}>|-{3,}|\.+->|\.+-|={2,}>|={3,})")
+BREAK_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+# Opening bracket, closing bracket, shape; longer openers first
+SHAPES = (
+    ("((", "))", "circle"),
+    ("([", "])", "stadium"),
+    ("[[", "]]", "subroutine"),
+    ("{{", "}}", "hexagon"),
+    ("[", "]", "rect"),
+    ("(", ")", "round"),
+    ("{", "}", "diamond"),
+)
+UNSUPPORTED_OPENERS = ("(((", "[(", "[/", "[\\", ">")
+UNSUPPORTED_KEYWORDS = {"subgraph", "end", "classdef", "class", "style", "linkstyle", "click", "direction"}
+
+
+class UnsupportedDiagram(Exception):
+    """The diagram is outside the supported subset, or PNG output needs Pillow."""
+
+
+class FlowNode:
+    def __init__(self, node_id: str):
+        self.id = node_id
+        self.label = node_id
+        self.shape = "rect"
+        self.lines = []
+        self.width = self.height = 0.0
+        self.x = self.y = 0.0
+
+
+class FlowEdge:
+    def __init__(self, source: str, target: str, label: str, line: str, arrow: bool):
+        self.source = source
+        self.target = target
+        self.label = label
+        self.line = line  # "solid", "dotted" or "thick"
+        self.arrow = arrow
+        self.lines = []
+        self.label_width = self.label_height = 0.0
+        self.label_at = None
+        self.points = []
+        self.head = None
+
+
+class Flowchart:
+    def __init__(self, direction: str):
+        self.direction = direction
+        self.nodes = {}  # id -> FlowNode, in definition order
+        self.edges = []
+        self.width = self.height = 0.0
+
+
+# --- Parsing ---
+
+def split_statements(code: str):
+    """Yields (line number, statement): lines split on `;` outside labels, without comments."""
+    for number, line in enumerate(code.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("%%"):
+            continue
+        depth, quoted, start = 0, False, 0
+        for i, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char in "[({":
+                depth += 1
+            elif char in "])}":
+                depth -= 1
+            elif char == ";" and depth <= 0:
+                if line[start:i].strip():
+                    yield number, line[start:i].strip()
+                start = i + 1
+        if line[start:].strip():
+            yield number, line[start:].strip()
+
+
+def _clean_label(text: str) -> str:
+    text = text.strip()
+    if len(text) > 1 and text.startswith('"') and text.endswith('"'):
+        text = text[1:-1]
+    text = text.replace("\\(", "(").replace("\\)", ")")
+    text = text.replace("#quot;", '"')
+    return BREAK_RE.sub("\n", text).strip()
+
+
+def _parse_label(text: str, pos: int, closer: str) -> tuple:
+    """Reads a label up to `closer`; returns (label, position after the closer)."""
+    if text.startswith('"', pos):
+        end = text.find('"', pos + 1)
+        if end < 0 or not text.startswith(closer, end + 1):
+            raise UnsupportedDiagram(f"unterminated label: {text!r}")
+        return _clean_label(text[pos + 1:end]), end + 1 + len(closer)
+    i = pos
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text.startswith(closer, i):
+            return _clean_label(text[pos:i]), i + len(closer)
+        i += 1
+    raise UnsupportedDiagram(f"unterminated label: {text!r}")
+
+
+def _parse_node(chart: Flowchart, text: str, pos: int) -> tuple:
+    match = NODE_ID_RE.match(text, pos)
+    if not match:
+        raise UnsupportedDiagram(f"expected a node at {text[pos:]!r}")
+    node_id, pos = match.group(), match.end()
+    if any(text.startswith(opener, pos) for opener in UNSUPPORTED_OPENERS):
+        raise UnsupportedDiagram(f"unsupported node shape: {text[match.start():]!r}")
+
+    node = chart.nodes.get(node_id)
+    if node is None:
+        node = chart.nodes[node_id] = FlowNode(node_id)
+    for opener, closer, shape in SHAPES:
+        if text.startswith(opener, pos):
+            node.label, pos = _parse_label(text, pos + len(opener), closer)
+            node.shape = shape
+            break
+    return node_id, pos
+
+
+def _skip_spaces(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _parse_statement(chart: Flowchart, statement: str):
+    source, pos = _parse_node(chart, statement, 0)
+    while True:
+        pos = _skip_spaces(statement, pos)
+        if pos >= len(statement):
+            return
+        match = ARROW_RE.match(statement, pos)
+        if match:
+            operator, label = match.group(1), match.group(2) or ""
+        else:
+            match = TEXT_ARROW_RE.match(statement, pos)
+            if not match:
+                raise UnsupportedDiagram(f"unsupported syntax: {statement!r}")
+            operator, label = match.group(3), match.group(2)
+        target, pos = _parse_node(chart, statement, _skip_spaces(statement, match.end()))
+        if target == source:
+            raise UnsupportedDiagram(f"self-loop on {source}")
+        line = "dotted" if "." in operator else "thick" if operator.startswith("=") else "solid"
+        chart.edges.append(FlowEdge(source, target, _clean_label(label), line, operator.endswith(">")))
+        source = target
+
+
+def parse_flowchart(code: str) -> Flowchart:
+    """Parses Mermaid flowchart code; raises UnsupportedDiagram outside the subset."""
+    statements = [statement for _, statement in split_statements(code)]
+    header = HEADER_RE.match(statements[0]) if statements else None
+    if not header:
+        raise UnsupportedDiagram("not a graph/flowchart diagram")
+    direction = (header.group(1) or "TB").upper().replace("TD", "TB")
+    chart = Flowchart(direction)
+    for statement in statements[1:]:
+        if statement.split(None, 1)[0].lower() in UNSUPPORTED_KEYWORDS:
+            raise UnsupportedDiagram(f"unsupported statement: {statement!r}")
+        _parse_statement(chart, statement)
+    if not chart.nodes:
+        raise UnsupportedDiagram("empty flowchart")
+    return chart
+
+
+def is_supported(code: str) -> bool:
+    try:
+        parse_flowchart(code)
+        return True
+    except UnsupportedDiagram:
+        return False
+
+
+# --- Text ---
+
+@lru_cache(maxsize=None)
+def _pil():
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+        return Image, ImageDraw, ImageFont
+    except ImportError:
+        return None
+
+
+@lru_cache(maxsize=16)
+def _font(size: int):
+    """A scalable font at `size` px, or None without Pillow (or with only its bitmap font)."""
+    pil = _pil()
+    if pil is None:
+        return None
+    font_module = pil[2]
+    for name in FONT_FILES:
+        try:
+            return font_module.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return font_module.load_default(size)
+    except TypeError:  # Pillow < 10.1
+        return None
+
+
+def _text_width(text: str) -> float:
+    font = _font(FONT_SIZE)
+    if font is None:
+        return len(text) * FONT_SIZE * 0.6
+    return font.getlength(text)
+
+
+def wrap_label(label: str, width: float = WRAP_WIDTH) -> list:
+    lines = []
+    for paragraph in label.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and _text_width(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _text_size(lines: list) -> tuple:
+    return max(_text_width(line) for line in lines), len(lines) * FONT_SIZE * LINE_HEIGHT
+
+
+# --- Layout ---
+
+def _node_size(shape: str, text_width: float, text_height: float) -> tuple:
+    width, height = text_width + 2 * NODE_PADDING_X, text_height + 2 * NODE_PADDING_Y
+    if shape == "circle":
+        diameter = max(text_width, text_height) + 2 * NODE_PADDING_Y
+        return diameter, diameter
+    if shape == "diamond":
+        # A rhombus 1.5x the text width and 3x its height just encloses the text box
+        return 1.5 * text_width + 2 * NODE_PADDING_Y, 3 * text_height + 2 * NODE_PADDING_Y
+    if shape in ("stadium", "hexagon"):
+        return width + height / 2, height
+    return width, height
+
+
+def _reversed_edges(chart: Flowchart) -> set:
+    """Indexes of edges closing a cycle (depth-first in definition order), drawn against the flow."""
+    adjacency = {node_id: [] for node_id in chart.nodes}
+    for index, edge in enumerate(chart.edges):
+        adjacency[edge.source].append((edge.target, index))
+    state, reversed_edges = {}, set()
+    for root in chart.nodes:
+        if root in state:
+            continue
+        state[root] = "active"
+        stack = [(root, iter(adjacency[root]))]
+        while stack:
+            node_id, targets = stack[-1]
+            for target, index in targets:
+                if state.get(target) == "active":
+                    reversed_edges.add(index)
+                elif target not in state:
+                    state[target] = "active"
+                    stack.append((target, iter(adjacency[target])))
+                    break
+            else:
+                state[node_id] = "done"
+                stack.pop()
+    return reversed_edges
+
+
+def _crossings(layers: list, successors: dict) -> int:
+    total = 0
+    for upper, lower in zip(layers, layers[1:]):
+        index = {v: i for i, v in enumerate(lower)}
+        links = [(i, index[w]) for i, v in enumerate(upper) for w in successors[v] if w in index]
+        for a in range(len(links)):
+            for b in range(a + 1, len(links)):
+                if (links[a][0] - links[b][0]) * (links[a][1] - links[b][1]) < 0:
+                    total += 1
+    return total
+
+
+def _order_layers(layers: list, predecessors: dict, successors: dict) -> list:
+    """Barycenter sweeps down and up, keeping the ordering with the fewest crossings."""
+    best, best_crossings = [list(layer) for layer in layers], _crossings(layers, successors)
+    for _ in range(ORDER_SWEEPS):
+        for indexes, neighbours in ((range(1, len(layers)), predecessors),
+                                    (range(len(layers) - 2, -1, -1), successors)):
+            for i in indexes:
+                adjacent = layers[i - 1] if neighbours is predecessors else layers[i + 1]
+                position = {v: p for p, v in enumerate(adjacent)}
+
+                def barycenter(item):
+                    p, v = item
+                    linked = [position[w] for w in neighbours[v] if w in position]
+                    return sum(linked) / len(linked) if linked else p
+
+                layers[i] = [v for _, v in sorted(enumerate(layers[i]), key=barycenter)]
+            crossings = _crossings(layers, successors)
+            if crossings < best_crossings:
+                best, best_crossings = [list(layer) for layer in layers], crossings
+    return best
+
+
+def _place_layer(layer: list, desired: dict, size: dict, dummies: set, position: dict):
+    """Puts a layer's vertices as close to `desired` as their order and spacing allow."""
+    placed = []
+    for v in layer:
+        p = desired[v]
+        if placed:
+            previous = placed[-1]
+            gap = DUMMY_SPACING if previous in dummies or v in dummies else NODE_SPACING
+            p = max(p, position[previous] + (size[previous] + size[v]) / 2 + gap)
+        position[v] = p
+        placed.append(v)
+    shift = sum(desired[v] - position[v] for v in layer) / len(layer)
+    for v in layer:
+        position[v] += shift
+
+
+def _border_point(node: FlowNode, toward: tuple) -> tuple:
+    dx, dy = toward[0] - node.x, toward[1] - node.y
+    if dx == 0 and dy == 0:
+        return node.x, node.y
+    half_width, half_height = node.width / 2, node.height / 2
+    if node.shape == "circle":
+        t = half_width / math.hypot(dx, dy)
+    elif node.shape == "diamond":
+        t = 1 / (abs(dx) / half_width + abs(dy) / half_height)
+    else:
+        t = 1 / max(abs(dx) / half_width, abs(dy) / half_height)
+    return node.x + dx * t, node.y + dy * t
+
+
+def layout_flowchart(chart: Flowchart) -> Flowchart:
+    """
+    Layered layout: cycles broken, nodes ranked by longest path, long edges routed
+    through dummy vertices, layers ordered by barycenter and positioned along the
+    cross axis towards their neighbours.
+    """
+    for node in chart.nodes.values():
+        node.lines = wrap_label(node.label)
+        node.width, node.height = _node_size(node.shape, *_text_size(node.lines))
+    for edge in chart.edges:
+        if edge.label:
+            edge.lines = wrap_label(edge.label)
+            text_width, text_height = _text_size(edge.lines)
+            edge.label_width, edge.label_height = text_width + 2 * LABEL_PADDING, text_height + 2 * LABEL_PADDING
+
+    horizontal = chart.direction in ("LR", "RL")
+    main_size = {n.id: (n.width if horizontal else n.height) for n in chart.nodes.values()}
+    cross_size = {n.id: (n.height if horizontal else n.width) for n in chart.nodes.values()}
+
+    # Rank along the flow, with cycle-closing edges turned around
+    reversed_edges = _reversed_edges(chart)
+    oriented = [
+        (e.target, e.source) if i in reversed_edges else (e.source, e.target) for i, e in enumerate(chart.edges)
+    ]
+    incoming = {node_id: 0 for node_id in chart.nodes}
+    outgoing = {node_id: [] for node_id in chart.nodes}
+    for source, target in oriented:
+        incoming[target] += 1
+        outgoing[source].append(target)
+    rank = {node_id: 0 for node_id in chart.nodes}
+    ready = [node_id for node_id in chart.nodes if incoming[node_id] == 0]
+    while ready:
+        node_id = ready.pop(0)
+        for target in outgoing[node_id]:
+            rank[target] = max(rank[target], rank[node_id] + 1)
+            incoming[target] -= 1
+            if incoming[target] == 0:
+                ready.append(target)
+
+    # Dummy vertices wherever an edge skips ranks
+    predecessors = {node_id: [] for node_id in chart.nodes}
+    successors = {node_id: [] for node_id in chart.nodes}
+    dummies, chains = set(), []
+    for index, (source, target) in enumerate(oriented):
+        chain = [source]
+        for r in range(rank[source] + 1, rank[target]):
+            dummy = f"__dummy_{index}_{r}"
+            dummies.add(dummy)
+            rank[dummy] = r
+            main_size[dummy] = cross_size[dummy] = 0.0
+            predecessors[dummy], successors[dummy] = [], []
+            chain.append(dummy)
+        chain.append(target)
+        for upper, lower in zip(chain, chain[1:]):
+            successors[upper].append(lower)
+            predecessors[lower].append(upper)
+        chains.append(chain)
+
+    layers = [[] for _ in range(max(rank.values()) + 1)]
+    for v in list(chart.nodes) + [v for chain in chains for v in chain[1:-1]]:
+        layers[rank[v]].append(v)
+    layers = _order_layers(layers, predecessors, successors)
+
+    # Cross axis: spread each layer, then pull it towards its neighbours
+    cross = {}
+    for layer in layers:
+        _place_layer(layer, {v: 0.0 for v in layer}, cross_size, dummies, cross)
+    for indexes, neighbours in ((range(1, len(layers)), predecessors),
+                                (range(len(layers) - 2, -1, -1), successors),
+                                (range(1, len(layers)), predecessors)):
+        for i in indexes:
+            desired = {}
+            for v in layers[i]:
+                linked = [cross[w] for w in neighbours[v]]
+                desired[v] = sum(linked) / len(linked) if linked else cross[v]
+            _place_layer(layers[i], desired, cross_size, dummies, cross)
+
+    # Main axis: layer thickness plus room for edge labels between layers
+    gaps = [RANK_SPACING] * len(layers)
+    for edge, chain in zip(chart.edges, chains):
+        if edge.label:
+            boundary = rank[chain[0]] + (len(chain) - 2) // 2
+            gaps[boundary] = max(gaps[boundary], RANK_SPACING + (edge.label_width if horizontal else edge.label_height))
+    thickness = [max(main_size[v] for v in layer) for layer in layers]
+    main, offset = [], 0.0
+    for i, t in enumerate(thickness):
+        main.append(offset + t / 2)
+        offset += t + gaps[i]
+
+    sign = -1 if chart.direction in ("RL", "BT") else 1
+
+    def point(v) -> tuple:
+        m = sign * main[rank[v]]
+        return (m, cross[v]) if horizontal else (cross[v], m)
+
+    for node in chart.nodes.values():
+        node.x, node.y = point(node.id)
+
+    for index, (edge, chain) in enumerate(zip(chart.edges, chains)):
+        points = [point(v) for v in chain]
+        points[0] = _border_point(chart.nodes[chain[0]], points[1])
+        points[-1] = _border_point(chart.nodes[chain[-1]], points[-2])
+        if edge.label:
+            k = (len(points) - 2) // 2
+            edge.label_at = ((points[k][0] + points[k + 1][0]) / 2, (points[k][1] + points[k + 1][1]) / 2)
+        if index in reversed_edges:
+            points.reverse()
+        if edge.arrow:
+            (x0, y0), (x1, y1) = points[-2], points[-1]
+            length = math.hypot(x1 - x0, y1 - y0) or 1.0
+            ux, uy = (x1 - x0) / length, (y1 - y0) / length
+            bx, by = x1 - ux * ARROW_LENGTH, y1 - uy * ARROW_LENGTH
+            half = ARROW_WIDTH / 2
+            edge.head = [(x1, y1), (bx - uy * half, by + ux * half), (bx + uy * half, by - ux * half)]
+            points[-1] = (bx, by)
+        edge.points = points
+
+    # Shift everything into view
+    boxes = [(n.x - n.width / 2, n.y - n.height / 2, n.x + n.width / 2, n.y + n.height / 2) for n in chart.nodes.values()]
+    for edge in chart.edges:
+        boxes += [(x, y, x, y) for x, y in edge.points + (edge.head or [])]
+        if edge.label_at:
+            x, y = edge.label_at
+            boxes.append((x - edge.label_width / 2, y - edge.label_height / 2,
+                          x + edge.label_width / 2, y + edge.label_height / 2))
+    left, top = min(b[0] for b in boxes) - MARGIN, min(b[1] for b in boxes) - MARGIN
+    chart.width = max(b[2] for b in boxes) + MARGIN - left
+    chart.height = max(b[3] for b in boxes) + MARGIN - top
+    for node in chart.nodes.values():
+        node.x, node.y = node.x - left, node.y - top
+    for edge in chart.edges:
+        edge.points = [(x - left, y - top) for x, y in edge.points]
+        if edge.head:
+            edge.head = [(x - left, y - top) for x, y in edge.head]
+        if edge.label_at:
+            edge.label_at = (edge.label_at[0] - left, edge.label_at[1] - top)
+    return chart
+
+
+# --- Output ---
+
+def _shape_outline(node: FlowNode) -> list:
+    """Polygon corners of the diamond and hexagon shapes."""
+    x, y, hw, hh = node.x, node.y, node.width / 2, node.height / 2
+    if node.shape == "diamond":
+        return [(x, y - hh), (x + hw, y), (x, y + hh), (x - hw, y)]
+    inset = hh / 2
+    return [(x - hw + inset, y - hh), (x + hw - inset, y - hh), (x + hw, y),
+            (x + hw - inset, y + hh), (x - hw + inset, y + hh), (x - hw, y)]
+
+
+def _line_centers(lines: list, center_y: float) -> list:
+    line_height = FONT_SIZE * LINE_HEIGHT
+    top = center_y - len(lines) * line_height / 2
+    return [top + (i + 0.5) * line_height for i in range(len(lines))]
+
+
+def _svg_text(lines: list, x: float, y: float) -> str:
+    return "".join(
+        f'<text x="{x:.1f}" y="{line_y:.1f}" text-anchor="middle" dominant-baseline="central" '
+        f'font-family="{FONT_FAMILY}" font-size="{FONT_SIZE}" fill="{COLORS["text"]}">{escape(line)}</text>'
+        for line, line_y in zip(lines, _line_centers(lines, y))
+    )
+
+
+def _svg_points(points: list) -> str:
+    return " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+
+
+def flowchart_to_svg(chart: Flowchart, background: str = "white") -> str:
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{chart.width:.0f}" height="{chart.height:.0f}" '
+        f'viewBox="0 0 {chart.width:.1f} {chart.height:.1f}">',
+        f'<rect width="100%" height="100%" fill="{escape(background)}"/>',
+    ]
+    for edge in chart.edges:
+        dash = ' stroke-dasharray="3,3"' if edge.line == "dotted" else ""
+        parts.append(
+            f'<polyline points="{_svg_points(edge.points)}" fill="none" stroke="{COLORS["edge"]}" '
+            f'stroke-width="{EDGE_WIDTHS[edge.line]}"{dash}/>'
+        )
+        if edge.head:
+            parts.append(f'<polygon points="{_svg_points(edge.head)}" fill="{COLORS["edge"]}"/>')
+    for edge in chart.edges:
+        if edge.label_at:
+            x, y = edge.label_at
+            parts.append(
+                f'<rect x="{x - edge.label_width / 2:.1f}" y="{y - edge.label_height / 2:.1f}" '
+                f'width="{edge.label_width:.1f}" height="{edge.label_height:.1f}" fill="{COLORS["label"]}"/>'
+            )
+            parts.append(_svg_text(edge.lines, x, y))
+
+    style = f'fill="{COLORS["fill"]}" stroke="{COLORS["stroke"]}" stroke-width="1"'
+    for node in chart.nodes.values():
+        x0, y0 = node.x - node.width / 2, node.y - node.height / 2
+        box = f'x="{x0:.1f}" y="{y0:.1f}" width="{node.width:.1f}" height="{node.height:.1f}"'
+        if node.shape == "circle":
+            parts.append(f'<circle cx="{node.x:.1f}" cy="{node.y:.1f}" r="{node.width / 2:.1f}" {style}/>')
+        elif node.shape in ("diamond", "hexagon"):
+            parts.append(f'<polygon points="{_svg_points(_shape_outline(node))}" {style}/>')
+        else:
+            radius = {"round": 5, "stadium": node.height / 2}.get(node.shape, 0)
+            parts.append(f'<rect {box} rx="{radius:.1f}" {style}/>')
+            if node.shape == "subroutine":
+                for x in (x0 + 8, x0 + node.width - 8):
+                    parts.append(f'<line x1="{x:.1f}" y1="{y0:.1f}" x2="{x:.1f}" y2="{y0 + node.height:.1f}" '
+                                 f'stroke="{COLORS["stroke"]}" stroke-width="1"/>')
+        parts.append(_svg_text(node.lines, node.x, node.y))
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def _dashes(points: list, dash: float, gap: float) -> list:
+    """Splits a polyline into dash segments."""
+    segments, drawing, left = [], True, dash
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        length = math.hypot(x1 - x0, y1 - y0)
+        travelled = 0.0
+        while travelled < length:
+            step = min(left, length - travelled)
+            if drawing:
+                t0, t1 = travelled / length, (travelled + step) / length
+                segments.append([(x0 + (x1 - x0) * t0, y0 + (y1 - y0) * t0),
+                                 (x0 + (x1 - x0) * t1, y0 + (y1 - y0) * t1)])
+            travelled += step
+            left -= step
+            if left <= 0:
+                drawing = not drawing
+                left = dash if drawing else gap
+    return segments
+
+
+def flowchart_to_png(chart: Flowchart, png_path: str, scale: float = 1, background: str = "white"):
+    """Draws the laid-out chart with Pillow, supersampled for smooth edges."""
+    pil = _pil()
+    factor = scale * SUPERSAMPLE
+    font = _font(round(FONT_SIZE * factor))
+    if pil is None or font is None:
+        raise UnsupportedDiagram("PNG output needs Pillow >= 10.1 or a TrueType font")
+    image_module, draw_module, _ = pil
+
+    size = (max(1, math.ceil(chart.width * factor)), max(1, math.ceil(chart.height * factor)))
+    image = image_module.new("RGB", size, background)
+    draw = draw_module.Draw(image)
+
+    def scaled(points):
+        return [(x * factor, y * factor) for x, y in points]
+
+    def text(lines, x, y):
+        for line, line_y in zip(lines, _line_centers(lines, y)):
+            draw.text((x * factor, line_y * factor), line, font=font, fill=COLORS["text"], anchor="mm")
+
+    outline = max(1, round(factor))
+    for edge in chart.edges:
+        width = max(1, round(EDGE_WIDTHS[edge.line] * factor))
+        if edge.line == "dotted":
+            for segment in _dashes(scaled(edge.points), 3 * factor, 3 * factor):
+                draw.line(segment, fill=COLORS["edge"], width=width)
+        else:
+            draw.line(scaled(edge.points), fill=COLORS["edge"], width=width, joint="curve")
+        if edge.head:
+            draw.polygon(scaled(edge.head), fill=COLORS["edge"])
+    for edge in chart.edges:
+        if edge.label_at:
+            x, y = edge.label_at
+            draw.rectangle(scaled([(x - edge.label_width / 2, y - edge.label_height / 2),
+                                   (x + edge.label_width / 2, y + edge.label_height / 2)]), fill=COLORS["label"])
+            text(edge.lines, x, y)
+
+    for node in chart.nodes.values():
+        box = scaled([(node.x - node.width / 2, node.y - node.height / 2),
+                      (node.x + node.width / 2, node.y + node.height / 2)])
+        if node.shape == "circle":
+            draw.ellipse(box, fill=COLORS["fill"], outline=COLORS["stroke"], width=outline)
+        elif node.shape in ("diamond", "hexagon"):
+            corners = scaled(_shape_outline(node))
+            draw.polygon(corners, fill=COLORS["fill"])
+            draw.line(corners + corners[:1], fill=COLORS["stroke"], width=outline, joint="curve")
+        else:
+            radius = {"round": 5 * factor, "stadium": node.height * factor / 2}.get(node.shape, 0)
+            draw.rounded_rectangle(box, radius=radius, fill=COLORS["fill"], outline=COLORS["stroke"], width=outline)
+            if node.shape == "subroutine":
+                for x in (box[0][0] + 8 * factor, box[1][0] - 8 * factor):
+                    draw.line([(x, box[0][1]), (x, box[1][1])], fill=COLORS["stroke"], width=outline)
+        text(node.lines, node.x, node.y)
+
+    resample = getattr(image_module, "Resampling", image_module).LANCZOS
+    final_size = (max(1, round(size[0] / SUPERSAMPLE)), max(1, round(size[1] / SUPERSAMPLE)))
+    os.makedirs(os.path.dirname(os.path.abspath(png_path)), exist_ok=True)
+    image.resize(final_size, resample).save(png_path, "PNG")
+
+
+def render_flowchart_svg(mermaid_code: str, options: dict = None) -> str:
+    """Renders a supported flowchart to SVG markup; raises UnsupportedDiagram otherwise."""
+    options = options or {}
+    chart = layout_flowchart(parse_flowchart(mermaid_code))
+    return flowchart_to_svg(chart, options.get("background", "white"))
+
+
+def render_flowchart_png(mermaid_code: str, png_path: str, options: dict = None):
+    """Renders a supported flowchart to png_path; raises UnsupportedDiagram otherwise."""
+    options = options or {}
+    if _font(FONT_SIZE) is None:
+        raise UnsupportedDiagram("PNG output needs Pillow >= 10.1 or a TrueType font")
+    chart = layout_flowchart(parse_flowchart(mermaid_code))
+    flowchart_to_png(chart, png_path, options.get("scale", 1), options.get("background", "white"))
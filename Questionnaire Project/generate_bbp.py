@@ -1,15 +1,22 @@
 import os
 import re
+import asyncio
 import docx
 import traceback
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores.chroma import Chroma
+from langchain_community.document_loaders import Docx2txtLoader
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from core.models import llm_instance, embeddings_instance
-from renderer import render_mermaid_to_png
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from llm_cache import cached_invoke, acached_invoke, astream_cached, cache_key
+from core.models import get_llm
+from section_cache import get_section_cache
+from vector_utils import sync_vectorstore, load_manifest
+from vectorstore_registry import get_retriever
+from renderer import render_mermaid, render_mermaid_batch
+from mermaid_validator import validate_mermaid, quote_labels
+from metrics import track_stage
 
 # Load environment variables
 load_dotenv(dotenv_path=".env", override=True)
@@ -22,31 +29,38 @@ OUTPUT_PATH = os.path.join(OUTPUT_DIR, "generated_bbp.docx")
 CHROMA_DB_DIR = os.path.join(OUTPUT_DIR, "chroma")
 PERSONA_PATH = "prompts/persona.txt"
 TRIGGER_PATH = "prompts/trigger_prompt.txt"
+# LLM attempts at fixing a diagram that fails validation (0 disables repair)
+MERMAID_REPAIR_ATTEMPTS = int(os.getenv("MERMAID_REPAIR_ATTEMPTS", 1))
+# "single" asks for the whole BBP in one completion; "sections" generates each section
+# separately (with its own retrieval) and assembles them in order
+BBP_MODE = os.getenv("BBP_MODE", "sections")
+BBP_MODES = ("single", "sections")
+BBP_SECTION_CONCURRENCY = int(os.getenv("BBP_SECTION_CONCURRENCY", 4))
+
+# Inputs whose use is tracked per section; any other input (such as a Q&A document)
+# reaches every section
+UNDERSTANDING = "process_understanding"
+RECOMMENDATION = "process_recommendation"
+BBP_INPUTS = (UNDERSTANDING, RECOMMENDATION)
+
+# BBP sections in document order (see prompts/persona.txt): title, what to cover, whether
+# the section carries a Mermaid diagram, and the inputs it is generated from. A section is
+# only regenerated when one of its inputs changes (see section_cache.py).
+BBP_SECTIONS = [
+    ("Introduction", "project background, scope, client landscape and stakeholders", False, (UNDERSTANDING,)),
+    ("Objective", "business objectives and expected benefits of the SAP Ariba Sourcing implementation", False, BBP_INPUTS),
+    ("As-Is Process Description", "the current sourcing process, its manual steps and pain points", True, (UNDERSTANDING,)),
+    ("To-Be Process Design", "the future process from PR to RFQ in Ariba, evaluation, award and PO in S/4HANA", True, (RECOMMENDATION,)),
+    ("Master Data", "supplier master, material master and how they are synchronised", False, BBP_INPUTS),
+    ("Approval Matrix", "approval levels, roles and thresholds", False, (RECOMMENDATION,)),
+    ("Integration with S/4HANA", "integration through SAP Cloud Integration Gateway, interfaces and document flow", False, (RECOMMENDATION,)),
+    ("Configuration/Customization Requirements", "sourcing templates, fields, notifications and system settings", False, (RECOMMENDATION,)),
+    ("Reporting & Analytics", "standard reports and the KPIs they cover", False, (RECOMMENDATION,)),
+    ("Glossary", "SAP Ariba and S/4HANA terms used in the document", False, BBP_INPUTS),
+]
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Load BBP reference documents
-bbp_docs = []
-for fname in os.listdir(BBP_DIR):
-    path = os.path.join(BBP_DIR, fname)
-    if fname.endswith(".pdf"):
-        bbp_docs.extend(PyMuPDFLoader(path).load())
-    elif fname.endswith(".docx"):
-        bbp_docs.extend(Docx2txtLoader(path).load())
-
-# Split into chunks
-splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-chunks = splitter.split_documents(bbp_docs)
-
-# Load or persist Chroma vectorstore
-if os.path.exists(CHROMA_DB_DIR):
-    vectorstore = Chroma(persist_directory=CHROMA_DB_DIR, embedding_function=embeddings_instance)
-else:
-    vectorstore = Chroma.from_documents(chunks, embeddings_instance, persist_directory=CHROMA_DB_DIR)
-    vectorstore.persist()
-
-retriever = vectorstore.as_retriever()
-
 # Load prompts
 with open(PERSONA_PATH, "r", encoding="utf-8") as f:
     persona = f.read()
@@ -65,48 +79,300 @@ Query:
 {{question}}
 """)
 
-# RAG pipeline
-rag_chain = (
-    {
-        "context": retriever | (lambda docs: "\n\n".join([doc.page_content for doc in docs])),
-        "question": RunnablePassthrough()
-    }
-    | prompt
-    | llm_instance
-)
-
-# Escape parentheses to prevent Mermaid parser errors
-def sanitize_mermaid_code(code):
-    return re.sub(r"\((.*?)\)", r"\\(\1\\)", code)
-
-def generate_bbp_from_qa(qa_file_path=QA_PATH):
-    try:
-        qa_text = "\n".join([doc.page_content for doc in Docx2txtLoader(qa_file_path).load()])
-        response = rag_chain.invoke(qa_text)
-        content = response.content if hasattr(response, 'content') else response
+# One section of the BBP; the others are generated separately and assembled in order
+section_prompt = ChatPromptTemplate.from_template(f"""
+{persona}
 
-        # Extract Mermaid diagrams
-        mermaid_blocks = re.findall(r"```mermaid\n(.*?)```", content, re.DOTALL)
-        image_map = {}
+Write only section {{number}}, "{{title}}", of the SAP Ariba Sourcing BBP for XYZ Company, covering {{focus}}.
+The other sections are written separately, so do not repeat or summarize them.
+Start with the heading line "{{number}}. {{title}}" and populate the section with full content.
+{{diagram_instruction}}
 
-        for idx, code in enumerate(mermaid_blocks):
-            sanitized_code = sanitize_mermaid_code(code.strip())
-            png_path = render_mermaid_to_png(sanitized_code, OUTPUT_DIR, idx + 1)
-            if png_path:
-                image_map[f"[[DIAGRAM_{idx+1}]]"] = png_path
+Context:
+{{context}}
 
-        # Replace Mermaid blocks with placeholders
-        def repl(match):
-            match_str = match.group(1).strip()
-            for i, block in enumerate(mermaid_blocks):
-                if block.strip() == match_str:
-                    return f"[[DIAGRAM_{i+1}]]"
-            return "[[DIAGRAM_UNKNOWN]]"
+Query:
+{{question}}
+""")
 
-        cleaned = re.sub(r"```mermaid\n(.*?)```", repl, content, flags=re.DOTALL)
-        cleaned = re.sub(r"[#*`]+", "", cleaned)
+MERMAID_BLOCK_RE = re.compile(r"```mermaid\n(.*?)```", re.DOTALL)
+
+# Retriever and RAG pipeline, built on first use so importing this module stays cheap
+@lru_cache(maxsize=None)
+def get_bbp_retriever():
+    # Sync the BBP reference documents into the shared vectorstore
+    sync_vectorstore(docs_folder=BBP_DIR, persist_directory=CHROMA_DB_DIR, chunk_size=1000, chunk_overlap=100)
+    return get_retriever(CHROMA_DB_DIR)
+
+def format_docs(docs) -> str:
+    return "\n\n".join([doc.page_content for doc in docs])
+
+def retrieve_context(question: str) -> str:
+    with track_stage("retrieval"):
+        return format_docs(get_bbp_retriever().invoke(question))
+
+async def aretrieve_context(question: str) -> str:
+    # The first call syncs the vectorstore (parsing and embedding), so keep it off the event loop
+    retriever = await asyncio.to_thread(get_bbp_retriever)
+    with track_stage("retrieval"):
+        return format_docs(await retriever.ainvoke(question))
+
+@lru_cache(maxsize=None)
+def get_rag_chain():
+    return (
+        {
+            "context": RunnableLambda(retrieve_context, afunc=aretrieve_context),
+            "question": RunnablePassthrough()
+        }
+        | prompt
+        | RunnableLambda(
+            partial(cached_invoke, caller="generate_bbp.get_rag_chain"),
+            afunc=partial(acached_invoke, caller="generate_bbp.get_rag_chain"),
+        )
+    )
+
+def section_heading(line: str) -> str:
+    """A heading line reduced to its title: no markdown, numbering or trailing colon."""
+    return re.sub(r"^[#*\s]*(\d+(\.\d+)*\.?)?\s*", "", line).strip(" *:").lower()
+
+def format_bbp_section(number: int, title: str, text: str) -> str:
+    """Puts a generated section under its numbered heading, replacing the heading the LLM wrote."""
+    text = text.strip()
+    first, _, rest = text.partition("\n")
+    if section_heading(first) == title.lower():
+        text = rest.strip()
+    return f"{number}. {title}\n\n{text}"
+
+def bbp_section_messages(number: int, title: str, focus: str, diagram: bool, context: str, question: str):
+    diagram_instruction = (
+        "Include one Mermaid diagram of this process in a ```mermaid code block."
+        if diagram else "Do not include any Mermaid diagrams in this section."
+    )
+    return section_prompt.format_messages(
+        number=number, title=title, focus=focus, diagram_instruction=diagram_instruction,
+        context=context, question=question,
+    )
+
+def bbp_question(inputs: dict) -> str:
+    return "\n\n".join(text for text in inputs.values() if text)
+
+def section_question(section: tuple, inputs: dict) -> str:
+    """The part of the inputs a section is generated from: its own tracked inputs plus untracked ones."""
+    depends_on = section[3]
+    return bbp_question({name: text for name, text in inputs.items() if name in depends_on or name not in BBP_INPUTS})
+
+def reference_documents() -> dict:
+    """Content hashes of the indexed BBP reference documents, by path."""
+    manifest = load_manifest(CHROMA_DB_DIR) or {}
+    return {path: entry["hash"] for path, entry in manifest.get("files", {}).items()}
+
+def section_cache_key(number: int, section: tuple, inputs: dict) -> str:
+    """
+    Key of a section in the section cache: the inputs the section declares in BBP_SECTIONS,
+    its instructions, the reference documents and the model. Inputs the section does not
+    depend on are left out, so revising them leaves the key unchanged.
+    """
+    title, focus, diagram, _ = section
+    instructions = bbp_section_messages(number, title, focus, diagram, "", section_question(section, inputs))
+    return cache_key(instructions, get_llm(), {"reference_documents": reference_documents()})
+
+def generate_bbp_section(number: int, section: tuple, inputs: dict) -> str:
+    """
+    Generates one BBP section from the inputs it depends on, with retrieval focused on that
+    section. A section whose inputs are unchanged is returned from the section cache.
+    """
+    title, focus, diagram, _ = section
+    key = section_cache_key(number, section, inputs)
+    cached = get_section_cache().get(key)
+    if cached is not None:
+        print(f"♻️ Reusing BBP section {number}. {title}: its inputs are unchanged")
+        return cached
+
+    question = section_question(section, inputs)
+    context = retrieve_context(f"{title}: {focus}")
+    messages = bbp_section_messages(number, title, focus, diagram, context, question)
+    response = cached_invoke(
+        messages,
+        sections={"rag_context": context, "process_analysis": question},
+        caller="generate_bbp.generate_bbp_section",
+    )
+    text = format_bbp_section(number, title, response.content)
+    get_section_cache().set(key, text)
+    return text
+
+async def agenerate_bbp_section(number: int, section: tuple, inputs: dict) -> str:
+    title, focus, diagram, _ = section
+    key = await asyncio.to_thread(section_cache_key, number, section, inputs)
+    cached = await asyncio.to_thread(get_section_cache().get, key)
+    if cached is not None:
+        print(f"♻️ Reusing BBP section {number}. {title}: its inputs are unchanged")
+        return cached
+
+    question = section_question(section, inputs)
+    context = await aretrieve_context(f"{title}: {focus}")
+    messages = bbp_section_messages(number, title, focus, diagram, context, question)
+    response = await acached_invoke(
+        messages,
+        sections={"rag_context": context, "process_analysis": question},
+        caller="generate_bbp.generate_bbp_section",
+    )
+    text = format_bbp_section(number, title, response.content)
+    await asyncio.to_thread(get_section_cache().set, key, text)
+    return text
+
+def generate_bbp_sections(inputs: dict) -> str:
+    """Generates all BBP sections, BBP_SECTION_CONCURRENCY at a time, and joins them in order."""
+    get_bbp_retriever()  # sync the vectorstore once, before the sections fan out
+    with ThreadPoolExecutor(max_workers=min(BBP_SECTION_CONCURRENCY, len(BBP_SECTIONS))) as pool:
+        return "\n\n".join(pool.map(
+            lambda item: generate_bbp_section(item[0], item[1], inputs), enumerate(BBP_SECTIONS, 1)
+        ))
+
+async def astream_bbp_sections(inputs: dict):
+    """
+    Generates all BBP sections concurrently (BBP_SECTION_CONCURRENCY at a time) and yields
+    their text in document order, each as soon as it and every section before it are done.
+    """
+    await asyncio.to_thread(get_bbp_retriever)
+    slots = asyncio.Semaphore(BBP_SECTION_CONCURRENCY)
+
+    async def bounded(number: int, section: tuple) -> str:
+        async with slots:
+            return await agenerate_bbp_section(number, section, inputs)
+
+    tasks = [asyncio.create_task(bounded(number, section)) for number, section in enumerate(BBP_SECTIONS, 1)]
+    try:
+        for i, task in enumerate(tasks):
+            yield ("\n\n" if i else "") + await task
+    finally:
+        # A failed section or a closed stream stops the sections still running
+        for task in tasks:
+            task.cancel()
+
+def check_bbp_mode(mode: str):
+    if mode not in BBP_MODES:
+        raise Exception(f"Unknown BBP mode '{mode}' (use one of {', '.join(BBP_MODES)})")
+
+def generate_bbp_content(inputs: dict, mode: str = BBP_MODE) -> str:
+    """
+    Generates the BBP text from named inputs ({name: text}) in one completion ("single")
+    or per section ("sections").
+    """
+    check_bbp_mode(mode)
+    if mode == "sections":
+        return generate_bbp_sections(inputs)
+    response = get_rag_chain().invoke(bbp_question(inputs))
+    return response.content if hasattr(response, 'content') else response
+
+async def agenerate_bbp_content(inputs: dict, mode: str = BBP_MODE) -> str:
+    check_bbp_mode(mode)
+    if mode == "sections":
+        return "".join([text async for text in astream_bbp_sections(inputs)])
+    rag_chain = await asyncio.to_thread(get_rag_chain)
+    response = await rag_chain.ainvoke(bbp_question(inputs))
+    return response.content if hasattr(response, 'content') else response
+
+async def astream_bbp_content(inputs: dict, mode: str = BBP_MODE):
+    """Yields the BBP text as it is generated: completion chunks ("single") or whole sections ("sections")."""
+    check_bbp_mode(mode)
+    if mode == "sections":
+        async for text in astream_bbp_sections(inputs):
+            yield text
+        return
+
+    question = bbp_question(inputs)
+    context = await aretrieve_context(question)
+    messages = prompt.format_messages(context=context, question=question)
+    async for text in astream_cached(
+        messages,
+        sections={"rag_context": context, "process_analysis": question},
+        caller="generate_bbp.astream_bbp_from_process_analysis",
+    ):
+        yield text
+
+# Quote labels holding parentheses or brackets to prevent Mermaid parser errors
+def sanitize_mermaid_code(code):
+    return quote_labels(code)
+
+def mermaid_repair_prompt(code: str, errors: list) -> str:
+    problems = "\n".join(f"- {error}" for error in errors)
+    return (
+        "The following Mermaid diagram from a SAP Ariba Business Blueprint does not parse.\n\n"
+        f"Problems found:\n{problems}\n\n"
+        f"Diagram:\n{code}\n\n"
+        "Fix the syntax while keeping every node, label and connection. Use a `graph LR` or "
+        "`graph TD` flowchart and put labels containing special characters in double quotes. "
+        "Return only the corrected Mermaid code, without explanations or code fences."
+    )
+
+def repair_mermaid_code(code: str, errors: list) -> str:
+    """Asks the LLM to fix a diagram that failed validation; returns the new code."""
+    response = cached_invoke(
+        mermaid_repair_prompt(code, errors),
+        sections={"diagram": code},
+        caller="generate_bbp.repair_mermaid_code",
+    )
+    text = response.content if hasattr(response, "content") else response
+    fenced = re.search(r"```(?:mermaid)?\n(.*?)```", text, re.DOTALL)
+    return (fenced.group(1) if fenced else text).strip()
+
+def prepare_bbp_diagram(code: str) -> tuple:
+    """
+    Sanitizes and validates one Mermaid block, letting the LLM repair it up to
+    MERMAID_REPAIR_ATTEMPTS times. Returns (code, errors, repairs); errors is [] when valid.
+    """
+    code = sanitize_mermaid_code(code.strip())
+    errors = validate_mermaid(code)
+    repairs = 0
+    while errors and repairs < MERMAID_REPAIR_ATTEMPTS:
+        repairs += 1
+        try:
+            code = sanitize_mermaid_code(repair_mermaid_code(code, errors))
+        except Exception as e:
+            errors = errors + [f"repair failed: {e}"]
+            break
+        errors = validate_mermaid(code)
+    return code, errors, repairs
+
+def render_bbp_diagram(code: str, output_dir: str, index: int) -> dict:
+    """
+    Validates (repairing if needed) and renders one Mermaid block. Returns its report:
+    index, status ("rendered", "repaired", "invalid" or "render_failed"), path, errors, repairs.
+    Invalid diagrams never reach a renderer.
+    """
+    code, errors, repairs = prepare_bbp_diagram(code)
+    report = {"index": index, "status": "invalid", "path": None, "errors": errors, "repairs": repairs}
+    if errors:
+        print(f"⚠️ Mermaid diagram {index} is invalid and was not rendered: {'; '.join(errors)}")
+        return report
 
-        # Save to Word
+    try:
+        with track_stage("diagram_render"):
+            report["path"] = render_mermaid(code, output_dir, index)
+        report["status"] = "repaired" if repairs else "rendered"
+    except Exception as e:
+        print(f"⚠️ Failed to render Mermaid diagram {index}: {e}")
+        report.update(status="render_failed", errors=[str(e)])
+    return report
+
+def save_bbp_docx(content: str, mermaid_blocks: list, image_map: dict, doc_path: str) -> str:
+    """
+    Replaces Mermaid blocks with diagram placeholders and saves the BBP as a Word document.
+    Returns the cleaned text.
+    """
+    # Replace Mermaid blocks with placeholders
+    def repl(match):
+        match_str = match.group(1).strip()
+        for i, block in enumerate(mermaid_blocks):
+            if block.strip() == match_str:
+                return f"[[DIAGRAM_{i+1}]]"
+        return "[[DIAGRAM_UNKNOWN]]"
+
+    cleaned = MERMAID_BLOCK_RE.sub(repl, content)
+    cleaned = re.sub(r"[#*`]+", "", cleaned)
+
+    # Save to Word
+    with track_stage("docx_write"):
         doc = docx.Document()
         doc.add_heading("SAP Ariba Sourcing Business Blueprint", 0)
 
@@ -117,6 +383,8 @@ def generate_bbp_from_qa(qa_file_path=QA_PATH):
             elif para.startswith("[[DIAGRAM_"):
                 if image_map.get(para):
                     doc.add_picture(image_map[para], width=docx.shared.Inches(5.5))
+                else:
+                    doc.add_paragraph(f"[{para.strip('[]').replace('_', ' ').title()} could not be rendered]")
             elif re.match(r"^\d+\. ", para):
                 doc.add_heading(para, level=1)
             elif para.startswith("- ") or para.startswith("• "):
@@ -124,71 +392,123 @@ def generate_bbp_from_qa(qa_file_path=QA_PATH):
             else:
                 doc.add_paragraph(para)
 
-        doc.save(OUTPUT_PATH)
+        doc.save(doc_path)
+    return cleaned
+
+def write_bbp_document(content: str, output_dir: str, doc_path: str):
+    """
+    Renders the Mermaid diagrams of a BBP completion and saves it as a Word document.
+    Returns the cleaned text (diagrams replaced by placeholders), the diagram image map
+    and one report per diagram (see render_bbp_diagram).
+    """
+    # Extract Mermaid diagrams and render them concurrently in the shared browser
+    mermaid_blocks = MERMAID_BLOCK_RE.findall(content)
+    diagrams = render_mermaid_batch(mermaid_blocks, output_dir, render=render_bbp_diagram)
+    image_map = {f"[[DIAGRAM_{d['index']}]]": d["path"] for d in diagrams if d["path"]}
+
+    cleaned = save_bbp_docx(content, mermaid_blocks, image_map, doc_path)
+    return cleaned, image_map, diagrams
+
+def generate_bbp_from_qa(qa_file_path=QA_PATH, mode: str = BBP_MODE):
+    try:
+        qa_text = "\n".join([doc.page_content for doc in Docx2txtLoader(qa_file_path).load()])
+        content = generate_bbp_content({"qa_document": qa_text}, mode)
+
+        _, image_map, diagrams = write_bbp_document(content, OUTPUT_DIR, OUTPUT_PATH)
         print(f"✅ BBP generated and saved to: {OUTPUT_PATH}")
-        return content, image_map
+        return content, image_map, diagrams
 
     except Exception as e:
         print("❌ BBP generation failed.")
         print(traceback.format_exc())
-        return None, {}
+        return None, {}, []
 #############Addition here for testing BBP geneartion with PU and PR ##############
 
 
 OUTPUT_DIR = "output"
 BBP_DOC_PATH = f"{OUTPUT_DIR}/generated_bbp_process_analysis.docx"  # use same constant as app.py
 
-def generate_bbp_from_process_analysis(process_understanding: str, process_recommendation: str):
+def generate_bbp_from_process_analysis(process_understanding: str, process_recommendation: str, mode: str = BBP_MODE):
     try:
-        combined_text = f"{process_understanding}\n\n{process_recommendation}"
-        response = rag_chain.invoke(combined_text)
-        content = response.content if hasattr(response, 'content') else response
+        inputs = {UNDERSTANDING: process_understanding, RECOMMENDATION: process_recommendation}
+        content = generate_bbp_content(inputs, mode)
 
-        # Extract Mermaid diagrams
-        mermaid_blocks = re.findall(r"```mermaid\n(.*?)```", content, re.DOTALL)
-        image_map = {}
+        cleaned, image_map, diagrams = write_bbp_document(content, OUTPUT_DIR, BBP_DOC_PATH)
+        print(f"✅ BBP generated from analysis and saved to: {BBP_DOC_PATH}")
 
-        for idx, code in enumerate(mermaid_blocks):
-            sanitized_code = sanitize_mermaid_code(code.strip())
-            png_path = render_mermaid_to_png(sanitized_code, OUTPUT_DIR, idx + 1)
-            if png_path:
-                image_map[f"[[DIAGRAM_{idx+1}]]"] = png_path
+        return cleaned, image_map, diagrams  # ✅ text, diagram dict and per-diagram reports
 
-        # Replace Mermaid blocks with placeholders
-        def repl(match):
-            match_str = match.group(1).strip()
-            for i, block in enumerate(mermaid_blocks):
-                if block.strip() == match_str:
-                    return f"[[DIAGRAM_{i+1}]]"
-            return "[[DIAGRAM_UNKNOWN]]"
+    except Exception as e:
+        print("❌ BBP generation from process analysis failed.")
+        print(traceback.format_exc())
+        return None, {}, []
 
-        cleaned = re.sub(r"```mermaid\n(.*?)```", repl, content, flags=re.DOTALL)
-        cleaned = re.sub(r"[#*`]+", "", cleaned)
+async def agenerate_bbp_from_process_analysis(process_understanding: str, process_recommendation: str, mode: str = BBP_MODE):
+    """
+    Async variant of generate_bbp_from_process_analysis: the completion (or the sections)
+    is awaited and diagram rendering and the docx write run in a worker thread.
+    """
+    try:
+        inputs = {UNDERSTANDING: process_understanding, RECOMMENDATION: process_recommendation}
+        content = await agenerate_bbp_content(inputs, mode)
 
-        # Save BBP to docx
-        doc = docx.Document()
-        doc.add_heading("SAP Ariba Sourcing Business Blueprint", 0)
+        cleaned, image_map, diagrams = await asyncio.to_thread(write_bbp_document, content, OUTPUT_DIR, BBP_DOC_PATH)
+        print(f"✅ BBP generated from analysis and saved to: {BBP_DOC_PATH}")
 
-        for para in cleaned.split("\n\n"):
-            para = para.strip()
-            if not para:
-                continue
-            elif para.startswith("[[DIAGRAM_"):
-                if image_map.get(para):
-                    doc.add_picture(image_map[para], width=docx.shared.Inches(5.5))
-            elif re.match(r"^\d+\. ", para):
-                doc.add_heading(para, level=1)
-            elif para.startswith("- ") or para.startswith("• "):
-                doc.add_paragraph(para.strip("- •"), style="List Bullet")
-            else:
-                doc.add_paragraph(para)
+        return cleaned, image_map, diagrams
 
-        doc.save(BBP_DOC_PATH)
+    except Exception as e:
+        print("❌ BBP generation from process analysis failed.")
+        print(traceback.format_exc())
+        return None, {}, []
+
+async def astream_bbp_from_process_analysis(process_understanding: str, process_recommendation: str, mode: str = BBP_MODE):
+    """
+    Streams BBP generation as (event, data) pairs: "token" for each completion chunk
+    (each whole section, in order, in "sections" mode), "diagram" with each Mermaid
+    block's report (rendering starts as soon as the block is complete, while the rest
+    is still generating), then "document" and "done".
+    Failures are reported as an "error" event.
+    """
+    try:
+        inputs = {UNDERSTANDING: process_understanding, RECOMMENDATION: process_recommendation}
+        content = ""
+        render_tasks = []
+        image_map = {}
+        diagrams = []
+        emitted = 0
+
+        def diagram_event(report: dict):
+            if report["path"]:
+                image_map[f"[[DIAGRAM_{report['index']}]]"] = report["path"]
+            diagrams.append(report)
+            return "diagram", {**report, "rendered": bool(report["path"])}
+
+        async for text in astream_bbp_content(inputs, mode):
+            content += text
+            yield "token", {"text": text}
+
+            mermaid_blocks = MERMAID_BLOCK_RE.findall(content)
+            while len(render_tasks) < len(mermaid_blocks):
+                idx = len(render_tasks) + 1
+                render_tasks.append(asyncio.create_task(
+                    asyncio.to_thread(render_bbp_diagram, mermaid_blocks[idx - 1], OUTPUT_DIR, idx)
+                ))
+            while emitted < len(render_tasks) and render_tasks[emitted].done():
+                emitted += 1
+                yield diagram_event(render_tasks[emitted - 1].result())
+
+        mermaid_blocks = MERMAID_BLOCK_RE.findall(content)
+        while emitted < len(render_tasks):
+            emitted += 1
+            yield diagram_event(await render_tasks[emitted - 1])
+
+        cleaned = await asyncio.to_thread(save_bbp_docx, content, mermaid_blocks, image_map, BBP_DOC_PATH)
         print(f"✅ BBP generated from analysis and saved to: {BBP_DOC_PATH}")
-
-        return cleaned, image_map  # ✅ Fixed: returns text and diagram dict
+        yield "document", {"path": BBP_DOC_PATH}
+        yield "done", {"bbp_content": cleaned, "image_map": image_map, "diagrams": diagrams}
 
     except Exception as e:
         print("❌ BBP generation from process analysis failed.")
         print(traceback.format_exc())
-        return None, {}
+        yield "error", {"detail": str(e)}
@@ -1,4 +1,9 @@
-from core.models import llm_instance
+import os
+import re
+import json
+from llm_cache import cached_invoke, acached_invoke
+from schema import FollowUpPlan
+from history_manager import compact_history, acompact_history, compact_rag_context
 from langchain.prompts import ChatPromptTemplate
 
 # Updated prompt template to support iterative follow-up generation
@@ -24,6 +29,34 @@ FOLLOWUP_PERSONA = ChatPromptTemplate.from_messages([
     )
 ])
 
+MAX_FOLLOWUPS = int(os.getenv("MAX_FOLLOWUPS", 2))
+# "structured" plans all follow-ups in one call; "iterative" asks for one at a time
+FOLLOWUP_MODE = os.getenv("FOLLOWUP_MODE", "structured")
+
+# One call returns ranked candidates plus a stop decision; the UI pages through them
+FOLLOWUP_PLAN_PERSONA = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        "You are a senior SAP consultant.\n"
+        "Your job is to plan the follow-up questions for the current Q&A.\n"
+        "- Use the original question and answer\n"
+        "- Be aware of follow-ups that have already been asked and answered\n"
+        "- Consider the full business context and conversation so far\n\n"
+        "Propose at most {max_followups} follow-up questions, most valuable first, and only ones that "
+        "add significant depth or clarity. If none is meaningful, propose none and set stop to true.\n"
+        "Reply with JSON only, no markdown, in this shape:\n"
+        '{{"followups": ["question", ...], "stop": false, "reason": "one sentence"}}\n'
+    ),
+    (
+        "human",
+        "Original Question:\n{question}\n\n"
+        "User Answer:\n{answer}\n\n"
+        "Previous Follow-ups and Answers:\n{prior_followups}\n\n"
+        "Relevant Business Context from Documents:\n{rag_context}\n\n"
+        "Full Conversation History:\n{conversation_history}"
+    )
+])
+
 def format_followups_for_prompt(followups: list) -> str:
     """Formats previous follow-ups for the prompt."""
     if not followups:
@@ -33,17 +66,6 @@ def format_followups_for_prompt(followups: list) -> str:
         output += f"{i}. Q: {item['question']}\n   A: {item['answer']}\n"
     return output.strip()
 
-def format_history_for_prompt(convo: list) -> str:
-    """Formats full conversation history for prompt context."""
-    history_text = ""
-    for i, entry in enumerate(convo, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  ↳ Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
-
 def generate_next_followup(
     question: str,
     answer: str,
@@ -55,8 +77,9 @@ def generate_next_followup(
     Generates ONE follow-up question using LLM, or returns empty string if none is meaningful.
     """
     try:
-        formatted_history = format_history_for_prompt(conversation_history)
+        formatted_history = compact_history(conversation_history)
         formatted_followups = format_followups_for_prompt(prior_followups)
+        rag_context = compact_rag_context(rag_context)
 
         prompt = FOLLOWUP_PERSONA.format_messages(
             question=question,
@@ -66,7 +89,12 @@ def generate_next_followup(
             conversation_history=formatted_history
         )
 
-        response = llm_instance.invoke(prompt)
+        response = cached_invoke(prompt, sections={
+            "question_and_answer": f"{question}\n{answer}",
+            "prior_followups": formatted_followups,
+            "rag_context": rag_context or "",
+            "conversation_history": formatted_history,
+        })
         next_question = response.content.strip()
 
         return next_question if next_question else ""
@@ -78,12 +106,18 @@ def generate_all_followups(
     question: str,
     answer: str,
     rag_context: str,
-    conversation_history: list
+    conversation_history: list,
+    mode: str = FOLLOWUP_MODE
 ) -> list:
     """
-    Iteratively generates up to 2 follow-up questions per original Q&A.
+    Generates up to 2 follow-up questions per original Q&A, in one call ("structured")
+    or one call per question ("iterative").
     Returns a list of follow-up dicts with empty answers (to be filled in via UI).
     """
+    if mode == "structured":
+        plan = plan_followups(question, answer, rag_context, conversation_history, max_followups=2)
+        return [{"question": q, "answer": ""} for q in plan.followups]
+
     followups = []
 
     for _ in range(2):  # Max 2 follow-ups
@@ -104,3 +138,87 @@ def generate_all_followups(
         })
 
     return followups
+
+
+def parse_followup_plan(content: str, max_followups: int = MAX_FOLLOWUPS) -> FollowUpPlan:
+    """
+    Parses the JSON plan, tolerating code fences and surrounding text. A reply that is
+    not JSON falls back to the lines that look like questions (numbered, bulleted or
+    ending in "?"); without any, the plan stops.
+    """
+    text = content.strip()
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        plan = FollowUpPlan(**json.loads(match.group(0) if match else text))
+    except Exception:
+        questions = []
+        for line in text.splitlines():
+            line = line.strip()
+            marker = re.match(r"(?:[-•*]|\d+[.)])\s+", line)
+            if marker or line.endswith("?"):
+                questions.append(line[marker.end():].strip() if marker else line)
+        if not questions:
+            return FollowUpPlan(stop=True, reason="[Unparseable follow-up plan]")
+        plan = FollowUpPlan(followups=questions)
+
+    followups = [q.strip() for q in plan.followups if q and q.strip()][:max_followups]
+    return FollowUpPlan(followups=followups, stop=plan.stop or not followups, reason=plan.reason)
+
+def _followup_plan_prompt(question, answer, prior_followups, rag_context, formatted_history, max_followups) -> tuple:
+    """Builds the plan prompt from history already compacted by (a)compact_history."""
+    formatted_followups = format_followups_for_prompt(prior_followups)
+    rag_context = compact_rag_context(rag_context)
+    prompt = FOLLOWUP_PLAN_PERSONA.format_messages(
+        max_followups=max_followups,
+        question=question,
+        answer=answer,
+        prior_followups=formatted_followups,
+        rag_context=rag_context,
+        conversation_history=formatted_history
+    )
+    sections = {
+        "question_and_answer": f"{question}\n{answer}",
+        "prior_followups": formatted_followups,
+        "rag_context": rag_context or "",
+        "conversation_history": formatted_history,
+    }
+    return prompt, sections
+
+def plan_followups(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    prior_followups: list = None,
+    max_followups: int = MAX_FOLLOWUPS
+) -> FollowUpPlan:
+    """
+    Generates ranked follow-up candidates and a stop decision in a single LLM call.
+    """
+    try:
+        prompt, sections = _followup_plan_prompt(
+            question, answer, prior_followups or [], rag_context, compact_history(conversation_history), max_followups
+        )
+        response = cached_invoke(prompt, sections=sections)
+        return parse_followup_plan(response.content, max_followups)
+    except Exception as e:
+        return FollowUpPlan(stop=True, reason=f"[Error generating follow-ups: {e}]")
+
+async def aplan_followups(
+    question: str,
+    answer: str,
+    rag_context: str,
+    conversation_history: list,
+    prior_followups: list = None,
+    max_followups: int = MAX_FOLLOWUPS
+) -> FollowUpPlan:
+    """Async variant of plan_followups."""
+    try:
+        formatted_history = await acompact_history(conversation_history)
+        prompt, sections = _followup_plan_prompt(
+            question, answer, prior_followups or [], rag_context, formatted_history, max_followups
+        )
+        response = await acached_invoke(prompt, sections=sections)
+        return parse_followup_plan(response.content, max_followups)
+    except Exception as e:
+        return FollowUpPlan(stop=True, reason=f"[Error generating follow-ups: {e}]")
@@ -1,63 +1,89 @@
-from core.models import llm_instance
+from llm_cache import cached_invoke, acached_invoke
 from persona_prompt import QUESTION_PERSONA
 from probing_focus import get_llm_probing_focus
+from history_manager import compact_history, acompact_history, compact_rag_context
 
-def format_history_for_prompt(conversation_history: list) -> str:
+# Prompt variables reported separately in the token ledger
+QUESTION_PROMPT_SECTIONS = ("rag_context", "conversation_history", "probing_focus")
+
+def question_prompt_context(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str, formatted_history: str = None) -> dict:
     """
-    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
+    Collects the question persona variables for one subprocess. History and RAG context
+    are compacted to their token budgets.
     """
-    history_text = ""
-    for i, entry in enumerate(conversation_history, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  \u21b3 Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
+    if formatted_history is None:
+        formatted_history = compact_history(conversation_history, sub_process_name)
 
-def generate_suggested_questions(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> list:
+    # Inject probing focus
+    probing_focus = get_llm_probing_focus(sub_process_name, user_choices)
+
+    context_for_prompt = {
+        "user_choices": user_choices,
+        "rag_context": compact_rag_context(rag_context),
+        "conversation_history": formatted_history,
+        "sub_process_name": sub_process_name,
+        "probing_focus": probing_focus
+    }
+
+    return context_for_prompt
+
+def build_question_prompt(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str, formatted_history: str = None) -> list:
     """
-    Generate the next suggested discovery question(s).
+    Format the question persona prompt for one subprocess.
     """
-    try:
-        formatted_history = format_history_for_prompt(conversation_history)
-
-        # Inject probing focus
-        probing_focus = get_llm_probing_focus(sub_process_name, user_choices)
+    context_for_prompt = question_prompt_context(
+        user_choices, rag_context, conversation_history, sub_process_name, formatted_history
+    )
+    # CORRECTED: unpack context as kwargs
+    return QUESTION_PERSONA.format_messages(**context_for_prompt)
 
-        context_for_prompt = {
-            "user_choices": user_choices,
-            "rag_context": rag_context,
-            "conversation_history": formatted_history,
-            "sub_process_name": sub_process_name,
-            "probing_focus": probing_focus
-        }
+def question_prompt_sections(context_for_prompt: dict) -> dict:
+    return {name: context_for_prompt[name] or "" for name in QUESTION_PROMPT_SECTIONS}
 
-        # CORRECTED: unpack context as kwargs
-        formatted_prompt = QUESTION_PERSONA.format_messages(**context_for_prompt)
-        
+def parse_questions(content: str) -> list:
+    lines = content.strip().split("\n")
+    return [
+        line.strip("-•* ").strip()
+        for line in lines if line.strip()
+    ]
 
+def generate_suggested_questions(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> list:
+    """
+    Generate the next suggested discovery question(s).
+    """
+    try:
+        context_for_prompt = question_prompt_context(user_choices, rag_context, conversation_history, sub_process_name)
         formatted_prompt = QUESTION_PERSONA.format_messages(**context_for_prompt)
+        sections = question_prompt_sections(context_for_prompt)
 
         # Detect type of prompt backend and convert
         try:
             # Option 1: try sending as OpenAI-style messages
             raw_messages = [msg.to_dict() for msg in formatted_prompt]
-            response = llm_instance.invoke(raw_messages)
+            response = cached_invoke(raw_messages, sections=sections)
         except Exception:
             # Option 2: fallback to just sending plain text
-            response = llm_instance.invoke(formatted_prompt[0].content)
+            response = cached_invoke(formatted_prompt[0].content, sections=sections)
 
-        
+        return parse_questions(response.content)
 
+    except Exception as e:
+        return [f"[Error generating suggested questions: {e}]"]
 
-        lines = response.content.strip().split("\n")
-        questions = [
-            line.strip("-•* ").strip()
-            for line in lines if line.strip()
-        ]
-
-        return questions
+async def agenerate_suggested_questions(user_choices: dict, rag_context: str, conversation_history: list, sub_process_name: str) -> list:
+    """
+    Async variant of generate_suggested_questions.
+    """
+    try:
+        formatted_history = await acompact_history(conversation_history, sub_process_name)
+        context_for_prompt = question_prompt_context(
+            user_choices, rag_context, conversation_history, sub_process_name, formatted_history
+        )
+        formatted_prompt = QUESTION_PERSONA.format_messages(**context_for_prompt)
+        response = await acached_invoke(
+            formatted_prompt[0].content, sections=question_prompt_sections(context_for_prompt)
+        )
+        return parse_questions(response.content)
 
     except Exception as e:
         return [f"[Error generating suggested questions: {e}]"]
@@ -1,20 +1,7 @@
-from core.models import llm_instance
+from llm_cache import cached_invoke
 from persona_prompt import QUESTION_PERSONA  # If this still defines your persona text
 from probing_focus import get_llm_probing_focus
-
-
-def format_history_for_prompt(conversation_history: list) -> str:
-    """
-    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
-    """
-    history_text = ""
-    for i, entry in enumerate(conversation_history, 1):
-        history_text += f"Q{i}: {entry['question']}\n"
-        history_text += f"A{i}: {entry['answer']}\n"
-        for j, fup in enumerate(entry.get("followups", []), 1):
-            history_text += f"  ↳ Follow-up {j}: {fup['question']}\n"
-            history_text += f"     Answer: {fup['answer']}\n"
-    return history_text.strip()
+from history_manager import compact_history, compact_rag_context
 
 
 def generate_suggested_questions(
@@ -32,7 +19,8 @@ def generate_suggested_questions(
     """
     try:
         # Format the history and probing cues
-        formatted_history = format_history_for_prompt(conversation_history)
+        formatted_history = compact_history(conversation_history, sub_process_name)
+        rag_context = compact_rag_context(rag_context)
         probing_focus = get_llm_probing_focus(subprocess=sub_process_name, user_choices=user_choices)
 
         # Build system persona
@@ -73,7 +61,11 @@ Based on all the above, generate the **next 3 meaningful discovery questions** t
         print("🧠 formatted_prompt =", prompt)
 
         # Call the LLM
-        response = llm_instance.invoke(prompt)
+        response = cached_invoke(prompt, sections={
+            "rag_context": rag_context or "",
+            "conversation_history": formatted_history,
+            "probing_focus": probing_focus,
+        })
 
         # Extract and clean the questions
         lines = response.content.strip().split("\n")
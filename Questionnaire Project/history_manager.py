@@ -0,0 +1,179 @@
+# history_manager.py
+
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from llm_cache import cached_invoke, acached_invoke
+from token_accounting import count_tokens
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", 1500))
+SUBPROCESS_SUMMARY_WORDS = int(os.getenv("SUBPROCESS_SUMMARY_WORDS", 80))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 512))
+
+_summaries = OrderedDict()  # (sub_process_name, history digest) -> summary
+_summaries_lock = threading.Lock()
+
+
+def truncate_to_tokens(text: str, token_budget: int) -> str:
+    """Cuts text to the budget, preferring a paragraph or line boundary."""
+    if not text or count_tokens(text) <= token_budget:
+        return text
+    # Shrink proportionally, then snap back to the last boundary
+    cut = text[:max(1, len(text) * token_budget // count_tokens(text))]
+    while count_tokens(cut) > token_budget and len(cut) > 1:
+        cut = cut[:int(len(cut) * 0.9)]
+    for boundary in ("\n\n", "\n"):
+        index = cut.rfind(boundary)
+        if index > len(cut) // 2:
+            cut = cut[:index]
+            break
+    return cut.rstrip() + "\n[...]"
+
+
+def format_history_for_prompt(conversation_history: list) -> str:
+    """
+    Convert structured Q&A history (including follow-ups) into a readable string for the LLM.
+    """
+    history_text = ""
+    for i, entry in enumerate(conversation_history, 1):
+        history_text += f"Q{i}: {entry['question']}\n"
+        history_text += f"A{i}: {entry['answer']}\n"
+        for j, fup in enumerate(entry.get("followups", []), 1):
+            history_text += f"  ↳ Follow-up {j}: {fup['question']}\n"
+            history_text += f"     Answer: {fup['answer']}\n"
+    return history_text.strip()
+
+
+def split_history(conversation_history: list, current_subprocess: str = None) -> tuple:
+    """
+    Splits the history into ([(sub_process_name, entries), ...] for earlier subprocesses,
+    current entries). Entries are grouped by their "subprocess" key; the current
+    subprocess defaults to the one of the last entry. Untagged history counts as current.
+    """
+    if current_subprocess is None and conversation_history:
+        current_subprocess = conversation_history[-1].get("subprocess")
+
+    earlier, current = OrderedDict(), []
+    for entry in conversation_history:
+        name = entry.get("subprocess")
+        if name is None or name == current_subprocess:
+            current.append(entry)
+        else:
+            earlier.setdefault(name, []).append(entry)
+    return list(earlier.items()), current
+
+
+def summary_prompt(sub_process_name: str, history_text: str) -> str:
+    return (
+        "You are a SAP consultant. Summarize what the client said about the sub-process "
+        f"'{sub_process_name}' in at most {SUBPROCESS_SUMMARY_WORDS} words. Keep concrete facts "
+        "(tools, roles, approvals, volumes, pain points); drop the questions themselves.\n\n"
+        f"{history_text}"
+    )
+
+
+def _summary_key(sub_process_name: str, history_text: str) -> tuple:
+    return sub_process_name, hashlib.sha256(history_text.encode("utf-8")).hexdigest()
+
+
+def _cached_summary(key: tuple):
+    with _summaries_lock:
+        summary = _summaries.get(key)
+        if summary is not None:
+            _summaries.move_to_end(key)
+        return summary
+
+
+def _store_summary(key: tuple, summary: str):
+    with _summaries_lock:
+        _summaries[key] = summary
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+
+
+def summarize_subprocess(sub_process_name: str, entries: list) -> str:
+    """Returns a short summary of a finished subprocess, computed once per distinct history."""
+    history_text = format_history_for_prompt(entries)
+    key = _summary_key(sub_process_name, history_text)
+    summary = _cached_summary(key)
+    if summary is None:
+        summary = cached_invoke(summary_prompt(sub_process_name, history_text)).content.strip()
+        _store_summary(key, summary)
+    return summary
+
+
+async def asummarize_subprocess(sub_process_name: str, entries: list) -> str:
+    """Async variant of summarize_subprocess."""
+    history_text = format_history_for_prompt(entries)
+    key = _summary_key(sub_process_name, history_text)
+    summary = _cached_summary(key)
+    if summary is None:
+        summary = (await acached_invoke(summary_prompt(sub_process_name, history_text))).content.strip()
+        _store_summary(key, summary)
+    return summary
+
+
+def assemble_history(summaries: list, current: list, token_budget: int) -> str:
+    """
+    Combines the current subprocess verbatim with as many earlier summaries (newest first)
+    as the budget allows. If the current subprocess alone is over budget, its oldest
+    entries are dropped.
+    """
+    kept = list(current)
+    current_text = format_history_for_prompt(kept)
+    while len(kept) > 1 and count_tokens(current_text) > token_budget:
+        kept.pop(0)
+        current_text = format_history_for_prompt(kept)
+    current_text = truncate_to_tokens(current_text, token_budget)
+    if len(kept) < len(current):
+        current_text = f"[{len(current) - len(kept)} earlier answers omitted]\n{current_text}"
+
+    remaining = token_budget - count_tokens(current_text)
+    lines = []
+    for name, summary in reversed(summaries):
+        line = f"- {name}: {summary}"
+        cost = count_tokens(line) + 1
+        if cost > remaining:
+            break
+        lines.insert(0, line)
+        remaining -= cost
+    if not lines:
+        return current_text
+
+    omitted = len(summaries) - len(lines)
+    header = "Earlier sub-processes (summarized):"
+    if omitted:
+        header += f" [{omitted} older omitted]"
+    return f"{header}\n" + "\n".join(lines) + f"\n\nCurrent sub-process:\n{current_text}"
+
+
+def compact_history(conversation_history: list, current_subprocess: str = None, token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Formats the history for a prompt within `token_budget` tokens. History that fits is
+    returned verbatim; otherwise earlier subprocesses are replaced by cached summaries.
+    """
+    history_text = format_history_for_prompt(conversation_history)
+    if count_tokens(history_text) <= token_budget:
+        return history_text
+    earlier, current = split_history(conversation_history, current_subprocess)
+    summaries = [(name, summarize_subprocess(name, entries)) for name, entries in earlier]
+    return assemble_history(summaries, current, token_budget)
+
+
+async def acompact_history(conversation_history: list, current_subprocess: str = None, token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """Async variant of compact_history; missing summaries are generated concurrently."""
+    history_text = format_history_for_prompt(conversation_history)
+    if count_tokens(history_text) <= token_budget:
+        return history_text
+    earlier, current = split_history(conversation_history, current_subprocess)
+    texts = await asyncio.gather(*(asummarize_subprocess(name, entries) for name, entries in earlier))
+    summaries = [(name, text) for (name, _), text in zip(earlier, texts)]
+    return assemble_history(summaries, current, token_budget)
+
+
+def compact_rag_context(rag_context: str, token_budget: int = RAG_CONTEXT_TOKEN_BUDGET) -> str:
+    """Caps retrieved document context to its token budget."""
+    return truncate_to_tokens(rag_context, token_budget)
@@ -0,0 +1,257 @@
+# llm_cache.py
+
+import os
+import re
+import asyncio
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from langchain_core.messages import AIMessage
+from core.models import get_llm
+from token_accounting import token_ledger, calling_function
+from metrics import track_llm_call, LLM_CALLS
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_cache.sqlite"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+
+
+class LLMResponseCache:
+    """
+    Persistent SQLite cache of LLM completions with TTL expiry, LRU eviction
+    beyond `max_entries`, and hit/miss counters.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        """Returns the stored response, or None on a miss or when the cache is disabled."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Returns the process-wide LLM response cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES)
+        return _cache
+
+
+def _normalize_text(text) -> str:
+    text = "\n".join(line.rstrip() for line in str(text).strip().splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
+def normalize_prompt(prompt) -> list:
+    """
+    Reduces a prompt (string, prompt value, LangChain messages or role/content dicts)
+    to a list of [role, content] pairs with insignificant whitespace removed.
+    """
+    if hasattr(prompt, "to_messages"):
+        prompt = prompt.to_messages()
+    if isinstance(prompt, str):
+        return [["human", _normalize_text(prompt)]]
+
+    normalized = []
+    for message in prompt:
+        if isinstance(message, dict):
+            normalized.append([message.get("role", ""), _normalize_text(message.get("content", ""))])
+        elif isinstance(message, (tuple, list)):
+            normalized.append([str(message[0]), _normalize_text(message[1])])
+        else:
+            normalized.append([message.type, _normalize_text(message.content)])
+    return normalized
+
+
+def cache_key(prompt, llm, params: dict) -> str:
+    """Hashes the normalized prompt together with the model identity and call parameters."""
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+    try:
+        identifying = llm._identifying_params
+    except Exception:
+        identifying = {}
+    payload = {
+        "prompt": normalize_prompt(prompt),
+        "model": str(model),
+        "model_params": identifying,
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _prompt_text(prompt) -> str:
+    return "\n".join(content for _, content in normalize_prompt(prompt))
+
+
+def _usage(response) -> dict:
+    return getattr(response, "usage_metadata", None) or {}
+
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "total_tokens")
+
+
+def _add_usage(total: dict, usage: dict):
+    """Adds a stream chunk's usage to the running total; providers split it across chunks."""
+    for field in USAGE_FIELDS:
+        if usage.get(field):
+            total[field] = total.get(field, 0) + usage[field]
+
+
+def cached_invoke(prompt, use_cache: bool = True, sections: dict = None, caller: str = None, **params):
+    """
+    Invokes the configured LLM through the response cache. Pass use_cache=False to
+    always call the model (the fresh response is not stored either).
+
+    Every call is recorded in the token ledger under `caller` (the calling function by
+    default), with `sections` ({name: text}) breaking the prompt tokens down.
+    """
+    caller = caller or calling_function()
+    llm = get_llm()
+    started = time.perf_counter()
+    key = cache_key(prompt, llm, params) if use_cache else None
+
+    cached = get_llm_cache().get(key) if key else None
+    if cached is not None:
+        LLM_CALLS.inc(1, "cache_hit")
+        response = AIMessage(content=cached)
+    else:
+        with track_llm_call():
+            response = llm.invoke(prompt, **params)
+        if key:
+            get_llm_cache().set(key, response.content)
+
+    token_ledger.record(caller, _prompt_text(prompt), response.content, time.perf_counter() - started,
+                        cached=cached is not None, sections=sections, usage=_usage(response))
+    return response
+
+
+async def acached_invoke(prompt, use_cache: bool = True, sections: dict = None, caller: str = None, **params):
+    """Async counterpart of cached_invoke; the model call never blocks the event loop."""
+    caller = caller or calling_function()
+    llm = get_llm()
+    started = time.perf_counter()
+    key = cache_key(prompt, llm, params) if use_cache else None
+
+    cached = await asyncio.to_thread(get_llm_cache().get, key) if key else None
+    if cached is not None:
+        LLM_CALLS.inc(1, "cache_hit")
+        response = AIMessage(content=cached)
+    else:
+        with track_llm_call():
+            response = await llm.ainvoke(prompt, **params)
+        if key:
+            await asyncio.to_thread(get_llm_cache().set, key, response.content)
+
+    token_ledger.record(caller, _prompt_text(prompt), response.content, time.perf_counter() - started,
+                        cached=cached is not None, sections=sections, usage=_usage(response))
+    return response
+
+
+async def astream_cached(prompt, use_cache: bool = True, sections: dict = None, caller: str = None):
+    """
+    Streams the completion text chunk by chunk. A cache hit is yielded as a single
+    chunk; a streamed completion is stored once it has finished.
+    """
+    caller = caller or calling_function()
+    llm = get_llm()
+    started = time.perf_counter()
+    key = cache_key(prompt, llm, {}) if use_cache else None
+    if key:
+        cached = await asyncio.to_thread(get_llm_cache().get, key)
+        if cached is not None:
+            LLM_CALLS.inc(1, "cache_hit")
+            token_ledger.record(caller, _prompt_text(prompt), cached, time.perf_counter() - started,
+                                cached=True, sections=sections)
+            yield cached
+            return
+
+    parts = []
+    usage = {}
+    try:
+        with track_llm_call():
+            async for chunk in llm.astream(prompt):
+                _add_usage(usage, _usage(chunk))
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+    finally:
+        # Also reached when the consumer stops early, so a cut-off stream still records
+        # the tokens it used.
+        token_ledger.record(caller, _prompt_text(prompt), "".join(parts), time.perf_counter() - started,
+                            sections=sections, usage=usage)
+    if key:
+        await asyncio.to_thread(get_llm_cache().set, key, "".join(parts))
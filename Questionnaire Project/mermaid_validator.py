@@ -0,0 +1,224 @@
+# mermaid_validator.py
+#
+# Fast in-process checks for LLM-produced Mermaid, run before any renderer is started.
+# Flowcharts (what the BBP prompts ask for) are checked statement by statement; other
+# diagram types only need a known header.
+
+import re
+from flowchart_renderer import split_statements
+
+DIAGRAM_TYPES = {
+    "graph", "flowchart", "sequencediagram", "classdiagram", "statediagram", "statediagram-v2",
+    "erdiagram", "gantt", "pie", "journey", "mindmap", "timeline", "gitgraph", "quadrantchart",
+    "requirementdiagram",
+}
+DIRECTIONS = {"TB", "TD", "BT", "RL", "LR"}
+NODE_ID_RE = re.compile(r"\w+(?:-\w+)*")
+CLASS_SUFFIX_RE = re.compile(r":::[\w-]+")
+LINK_RE = re.compile(r"(<?(?:-{2,}[>ox]|-{3,}|={2,}[>ox]|={3,}|-\.+-[>ox]?|~{3,}))\s*(?:\|([^|]*)\|)?")
+TEXT_LINK_RE = re.compile(r"(--|-\.|==)\s+(.+?)\s+(-{2,}[>ox]?|\.+-[>ox]?|={2,}[>ox]?)(?=\s|\w|$)")
+# Opening bracket and accepted closing brackets; longer openers first
+NODE_SHAPES = (
+    ("(((", (")))",)),
+    ("((", ("))",)),
+    ("([", ("])",)),
+    ("[[", ("]]",)),
+    ("[(", (")]",)),
+    ("{{", ("}}",)),
+    ("[/", ("/]", "\\]")),
+    ("[\\", ("\\]", "/]")),
+    (">", ("]",)),
+    ("[", ("]",)),
+    ("(", (")",)),
+    ("{", ("}",)),
+)
+# Characters the Mermaid parser reads as syntax inside an unquoted label
+QUOTE_TRIGGERS = set("()[]{}|;")
+PAIRS = {"(": ")", "[": "]", "{": "}"}
+# Statement keyword -> minimum number of words
+KEYWORDS = {"classdef": 3, "class": 3, "style": 3, "linkstyle": 3, "click": 3, "direction": 2}
+
+
+class _SyntaxError(Exception):
+    pass
+
+
+def _near(text: str, pos: int) -> str:
+    return f"at '{text[pos:pos + 30]}'" if pos < len(text) else "at the end of the statement"
+
+
+def _quote(label: str) -> str:
+    """Returns the label in double quotes if Mermaid would otherwise parse its brackets."""
+    text = label.replace("\\(", "(").replace("\\)", ")")
+    if label.startswith('"') or not QUOTE_TRIGGERS.intersection(text):
+        return label
+    return '"' + text.strip().replace('"', "#quot;") + '"'
+
+
+def _read_label(text: str, pos: int, closers: tuple) -> tuple:
+    """Reads an unquoted or quoted label up to one of `closers`; returns (label, closer, end)."""
+    if text.startswith('"', pos):
+        end = text.find('"', pos + 1)
+        closer = next((c for c in closers if end >= 0 and text.startswith(c, end + 1)), None)
+        if closer is None:
+            raise _SyntaxError(f"unterminated quoted label {_near(text, pos)}")
+        return text[pos:end + 1], closer, end + 1 + len(closer)
+
+    # Brackets opened inside the label must close inside it
+    stack, i = [], pos
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            i += 2
+            continue
+        if not stack:
+            closer = next((c for c in closers if text.startswith(c, i)), None)
+            if closer:
+                return text[pos:i], closer, i + len(closer)
+        if char in PAIRS:
+            stack.append(PAIRS[char])
+        elif stack and char == stack[-1]:
+            stack.pop()
+        i += 1
+    raise _SyntaxError(f"unterminated label {_near(text, pos)}")
+
+
+def _scan_node(text: str, pos: int, edits: list) -> int:
+    """Parses one node reference; returns the position after it."""
+    match = NODE_ID_RE.match(text, pos)
+    if not match:
+        raise _SyntaxError(f"expected a node id {_near(text, pos)}")
+    pos = match.end()
+    for opener, closers in NODE_SHAPES:
+        if text.startswith(opener, pos):
+            start = pos + len(opener)
+            label, closer, pos = _read_label(text, start, closers)
+            if _quote(label) != label:
+                edits.append((start, start + len(label), _quote(label)))
+            break
+    suffix = CLASS_SUFFIX_RE.match(text, pos)
+    return suffix.end() if suffix else pos
+
+
+def _skip(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _scan_group(text: str, pos: int, edits: list) -> int:
+    """Parses `node (& node)*`."""
+    pos = _scan_node(text, pos, edits)
+    while True:
+        after = _skip(text, pos)
+        if not text.startswith("&", after):
+            return pos
+        pos = _scan_node(text, _skip(text, after + 1), edits)
+
+
+def _scan_statement(statement: str) -> list:
+    """
+    Checks a node/link statement. Returns the edits (start, end, replacement) that
+    quote its bracket-holding labels.
+    """
+    edits = []
+    pos = _scan_group(statement, 0, edits)
+    while True:
+        pos = _skip(statement, pos)
+        if pos >= len(statement):
+            return edits
+        match = LINK_RE.match(statement, pos)
+        if match:
+            label = match.group(2)
+            if label is not None and _quote(label) != label:
+                edits.append((match.start(2), match.end(2), _quote(label)))
+        else:
+            match = TEXT_LINK_RE.match(statement, pos)
+            if not match:
+                raise _SyntaxError(f"expected a link {_near(statement, pos)}")
+            label = match.group(2)
+            if _quote(label) != label:
+                # Quoted labels are only reliable in the |label| form
+                edits.append((match.start(), match.end(), match.group(3) + "|" + _quote(label) + "|"))
+        pos = _scan_group(statement, _skip(statement, match.end()), edits)
+
+
+def _header(statement: str) -> tuple:
+    words = statement.split()
+    return words[0].lower(), words[1:]
+
+
+def validate_mermaid(code: str) -> list:
+    """Returns the problems found in a Mermaid block ("line N: ..."), or [] when it looks valid."""
+    if not code or not code.strip():
+        return ["diagram is empty"]
+    if "```" in code:
+        return ["diagram contains a markdown code fence"]
+
+    statements = list(split_statements(code))
+    if not statements:
+        return ["diagram has no statements"]
+    number, header = statements[0]
+    kind, arguments = _header(header)
+    if kind not in DIAGRAM_TYPES:
+        return [f"line {number}: unknown diagram type '{header.split()[0]}'"]
+    if kind not in ("graph", "flowchart"):
+        return []
+
+    errors = []
+    if arguments and (len(arguments) > 1 or arguments[0].upper() not in DIRECTIONS):
+        errors.append(f"line {number}: invalid direction '{' '.join(arguments)}' (use TB, TD, BT, RL or LR)")
+    depth, links = 0, 0
+    for number, statement in statements[1:]:
+        keyword, arguments = _header(statement)
+        if keyword == "subgraph":
+            depth += 1
+        elif keyword == "end":
+            depth -= 1
+            if depth < 0:
+                errors.append(f"line {number}: 'end' without a matching 'subgraph'")
+                depth = 0
+        elif keyword in KEYWORDS:
+            if len(arguments) + 1 < KEYWORDS[keyword]:
+                errors.append(f"line {number}: incomplete '{keyword}' statement")
+        else:
+            try:
+                _scan_statement(statement)
+                links += 1
+            except _SyntaxError as e:
+                errors.append(f"line {number}: {e}")
+    if depth > 0:
+        errors.append(f"{depth} 'subgraph' block(s) without 'end'")
+    if not links and not errors:
+        errors.append("flowchart has no nodes")
+    return errors
+
+
+def quote_labels(code: str) -> str:
+    """
+    Puts flowchart labels containing brackets, parentheses, pipes or semicolons in
+    double quotes, Mermaid's own escape. Statements that do not parse, and other
+    diagram types, are left as they are.
+    """
+    statements = list(split_statements(code))
+    if not statements or _header(statements[0][1])[0] not in ("graph", "flowchart"):
+        return code
+
+    lines = code.splitlines()
+    cursor = {}  # line number -> where the next statement on that line starts
+    for number, statement in statements:
+        line = lines[number - 1]
+        offset = line.find(statement, cursor.get(number, 0))
+        cursor[number] = offset + len(statement)
+        keyword, _ = _header(statement)
+        if number == statements[0][0] or keyword in ("subgraph", "end") or keyword in KEYWORDS:
+            continue
+        try:
+            edits = _scan_statement(statement)
+        except _SyntaxError:
+            continue
+        for start, end, replacement in sorted(edits, reverse=True):
+            statement = statement[:start] + replacement + statement[end:]
+        lines[number - 1] = line[:offset] + statement + line[cursor[number]:]
+        cursor[number] = offset + len(statement)
+    return "\n".join(lines)
@@ -0,0 +1,119 @@
+// mermaid_worker.mjs
+//
+// Long-lived Mermaid renderer used by renderer.py: one headless browser for all diagrams
+// instead of one mmdc process (and browser start-up) per diagram.
+//
+// Protocol, one JSON object per line:
+//   stdout: {"ready": true} once the browser is up, or {"ready": false, "error": "..."}
+//   stdin:  {"id": 1, "code": "flowchart TD ...", "output": "/abs/diagram_1.png", "timeout": 30000,
+//            "options": {"width": 800, "height": 600, "scale": 1, "background": "white"}}
+//   stdout: {"id": 1, "ok": true} or {"id": 1, "ok": false, "error": "..."}
+// Requests are rendered concurrently, each in its own page; the caller bounds how many are in flight.
+//
+// Environment:
+//   MERMAID_CLI_DIR        @mermaid-js/mermaid-cli package to load (defaults to node_modules lookup)
+//   PUPPETEER_CONFIG_PATH  JSON options passed to puppeteer.launch
+
+import { createRequire } from "node:module";
+import { readFileSync, writeFileSync } from "node:fs";
+import { join } from "node:path";
+import { pathToFileURL } from "node:url";
+import readline from "node:readline";
+
+const CLI_DIR = process.env.MERMAID_CLI_DIR;
+// Same defaults as mmdc
+const DEFAULT_OPTIONS = { width: 800, height: 600, scale: 1, background: "white" };
+
+function reply(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+function readJson(path) {
+  return path ? JSON.parse(readFileSync(path, "utf-8")) : {};
+}
+
+function packageEntry(dir) {
+  const pkg = readJson(join(dir, "package.json"));
+  let entry = pkg.exports;
+  while (entry && typeof entry === "object") {
+    entry = entry["."] ?? entry.import ?? entry.default;
+  }
+  return join(dir, entry || pkg.main || "src/index.js");
+}
+
+async function loadModules() {
+  if (!CLI_DIR) {
+    return [await import("@mermaid-js/mermaid-cli"), await import("puppeteer")];
+  }
+  // Resolve puppeteer from the mermaid-cli install, which may be a global npm package
+  const cliRequire = createRequire(join(CLI_DIR, "package.json"));
+  return [
+    await import(pathToFileURL(packageEntry(CLI_DIR)).href),
+    await import(pathToFileURL(cliRequire.resolve("puppeteer")).href),
+  ];
+}
+
+async function render(browser, renderMermaid, { id, code, output, timeout, options }) {
+  const { width, height, scale, background } = { ...DEFAULT_OPTIONS, ...options };
+  let timer;
+  try {
+    const expired = new Promise((_, reject) => {
+      timer = setTimeout(() => reject(new Error(`timed out after ${timeout} ms`)), timeout);
+    });
+    const job = renderMermaid(browser, code, "png", {
+      viewport: { width, height, deviceScaleFactor: scale },
+      backgroundColor: background,
+    });
+    const { data } = await Promise.race([job, expired]);
+    writeFileSync(output, data);
+    reply({ id, ok: true });
+  } catch (error) {
+    reply({ id, ok: false, error: String(error?.message || error) });
+  } finally {
+    clearTimeout(timer);
+  }
+}
+
+async function main() {
+  let browser, renderMermaid;
+  try {
+    const [mermaidCli, puppeteerModule] = await loadModules();
+    renderMermaid = mermaidCli.renderMermaid;
+    if (typeof renderMermaid !== "function") {
+      throw new Error("@mermaid-js/mermaid-cli >= 10 is required (renderMermaid export)");
+    }
+    const puppeteer = puppeteerModule.default ?? puppeteerModule;
+    browser = await puppeteer.launch({ headless: true, ...readJson(process.env.PUPPETEER_CONFIG_PATH) });
+  } catch (error) {
+    reply({ ready: false, error: String(error?.message || error) });
+    process.exit(1);
+  }
+
+  // A crashed browser takes the worker down; renderer.py starts a new one on the next request
+  browser.on("disconnected", () => process.exit(1));
+  reply({ ready: true });
+
+  const inFlight = new Set();
+  const lines = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+  lines.on("line", (line) => {
+    if (!line.trim()) return;
+    let request;
+    try {
+      request = JSON.parse(line);
+    } catch (error) {
+      return;
+    }
+    const job = render(browser, renderMermaid, request);
+    inFlight.add(job);
+    job.finally(() => inFlight.delete(job));
+  });
+  // stdin closes when renderer.py shuts the worker down
+  lines.on("close", async () => {
+    await Promise.allSettled([...inFlight]);
+    browser.removeAllListeners("disconnected");
+    await browser.close().catch(() => {});
+    process.exit(0);
+  });
+}
+
+main();
@@ -0,0 +1,176 @@
+# metrics.py
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Seconds; long upper buckets because LLM calls and BBP generation take minutes at worst
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="' + _number(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {bucket_count}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """A gauge set directly, or read from `callback` (returning {label values: value}) at scrape time."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, amount: float = 1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception:
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "bbp_http_request_duration_seconds", "HTTP request latency by endpoint.", ("method", "endpoint", "status")
+))
+STAGE_LATENCY = registry.register(Histogram(
+    "bbp_stage_duration_seconds", "Latency of retrieval, LLM calls, diagram rendering and docx writing.", ("stage",)
+))
+LLM_IN_FLIGHT = registry.register(Gauge("bbp_llm_calls_in_flight", "LLM calls currently waiting on the model."))
+LLM_CALLS = registry.register(Counter("bbp_llm_calls_total", "LLM calls by result.", ("result",)))
+DIAGRAM_RENDERS = registry.register(Counter("bbp_diagram_renders_total", "Diagrams rendered (cache misses) by engine.", ("engine",)))
+
+
+def track_stage(stage: str):
+    """Context manager timing one stage ("retrieval", "llm", "diagram_render", "docx_write")."""
+    return STAGE_LATENCY.time(stage)
+
+
+@contextmanager
+def track_llm_call():
+    """Times a model call and counts it as in flight while it runs."""
+    LLM_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        LLM_IN_FLIGHT.dec()
+        STAGE_LATENCY.observe(time.perf_counter() - started, "llm")
+        LLM_CALLS.inc(1, result)
+
+
+def register_gauge(name: str, help_text: str, callback, label_names: tuple = ()):
+    """Registers a gauge computed at scrape time; callback returns {label values tuple: value}."""
+    return registry.register(Gauge(name, help_text, label_names, callback=callback))
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,106 @@
+# parallel_loader.py
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
+from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader
+
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 40))
+
+
+def _pdf_page_count(path: str) -> int:
+    import fitz
+    with fitz.open(path) as pdf:
+        return pdf.page_count
+
+
+def plan_tasks(paths: list) -> list:
+    """
+    Splits the files into (path, start_page, stop_page) tasks. PDFs longer than
+    PDF_PAGES_PER_TASK pages are fanned out by page range; everything else is one task.
+    """
+    tasks = []
+    for path in paths:
+        if path.endswith(".pdf"):
+            try:
+                page_count = _pdf_page_count(path)
+            except Exception:
+                page_count = 0  # let the worker report the real error
+            if page_count > PDF_PAGES_PER_TASK:
+                for start in range(0, page_count, PDF_PAGES_PER_TASK):
+                    tasks.append((path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+                continue
+        tasks.append((path, None, None))
+    return tasks
+
+
+def _load_pdf_pages(path: str, start: int, stop: int) -> list:
+    """Loads a page range with the same metadata layout as PyMuPDFLoader."""
+    import fitz
+    documents = []
+    with fitz.open(path) as pdf:
+        extra = {k: v for k, v in pdf.metadata.items() if isinstance(v, (str, int))}
+        for page_number in range(start, stop):
+            page = pdf[page_number]
+            documents.append(Document(
+                page_content=page.get_text(),
+                metadata={
+                    "source": path,
+                    "file_path": path,
+                    "page": page_number,
+                    "total_pages": pdf.page_count,
+                    **extra,
+                },
+            ))
+    return documents
+
+
+def load_task(task: tuple) -> tuple:
+    """
+    Worker entry point. Returns (documents, None) on success or (None, error) on failure,
+    so one bad file never aborts the batch.
+    """
+    path, start, stop = task
+    try:
+        if start is not None:
+            return _load_pdf_pages(path, start, stop), None
+        if path.endswith(".docx"):
+            return Docx2txtLoader(path).load(), None
+        if path.endswith(".pdf"):
+            return PyMuPDFLoader(path).load(), None
+        return [], None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def load_files_parallel(paths: list, max_workers: int = LOADER_WORKERS) -> tuple:
+    """
+    Parses files across a process pool.
+
+    Returns ({path: documents}, {path: error}). Documents keep the input file order
+    and page order; a file with any failed page range is reported as failed.
+    """
+    tasks = plan_tasks(paths)
+    # Parsing in a worker process that re-imported the app's main module stays in that process
+    if len(tasks) <= 1 or max_workers <= 1 or multiprocessing.parent_process() is not None:
+        results = [load_task(task) for task in tasks]
+    else:
+        # Spawned, not forked: the server's threads hold locks, HTTP pools and SQLite
+        # connections that a forked child would inherit mid-use
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(tasks)), mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = list(pool.map(load_task, tasks))
+
+    documents, failures = {}, {}
+    for (path, _, _), (docs, error) in zip(tasks, results):
+        if path in failures:
+            continue
+        if error is not None:
+            failures[path] = error
+            documents.pop(path, None)
+            continue
+        documents.setdefault(path, []).extend(docs)
+    return documents, failures
@@ -1,14 +1,27 @@
-from core.models import llm_instance
+import os
+import hashlib
+from llm_cache import cached_invoke, acached_invoke, astream_cached
 
-def generate_process_understanding(conversation_history: list) -> str:
-    """
-    Generates a bullet-point summary of the user's As-Is process understanding.
-    """
+# Incremental understanding updates between two full rebuilds from the whole conversation
+UNDERSTANDING_REBUILD_EVERY = int(os.getenv("UNDERSTANDING_REBUILD_EVERY", 10))
+
+def format_understanding_history(conversation_history: list) -> str:
     history_str = ""
     for i, item in enumerate(conversation_history, 1):
         history_str += f"Q{i}: {item['question']}\nA{i}: {item['answer']}\n"
         for j, fup in enumerate(item.get("followups", []), 1):
             history_str += f"  ↳ F{j}: {fup['question']}\n     A: {fup['answer']}\n"
+    return history_str
+
+def _history_section(conversation_history: list, formatter=format_understanding_history) -> dict:
+    # Token-ledger breakdown of the analysis prompts
+    return {"conversation_history": formatter(conversation_history)}
+
+def understanding_prompt(conversation_history: list) -> str:
+    """
+    Builds the prompt for a bullet-point summary of the user's As-Is process understanding.
+    """
+    history_str = format_understanding_history(conversation_history)
 
     prompt = (
         "You are a SAP consultant. Based on the following discovery conversation, "
@@ -16,14 +29,134 @@ def generate_process_understanding(conversation_history: list) -> str:
         f"{history_str}\n"
         "Return a clear, structured bullet-point summary of the user's current (As-Is) process understanding."
     )
+    return prompt
+
+def generate_process_understanding(conversation_history: list) -> str:
+    """
+    Generates a bullet-point summary of the user's As-Is process understanding.
+    """
+    response = cached_invoke(understanding_prompt(conversation_history), sections=_history_section(conversation_history))
+    return response.content.strip()
 
-    response = llm_instance.invoke(prompt)
+async def agenerate_process_understanding(conversation_history: list) -> str:
+    """Async variant of generate_process_understanding."""
+    response = await acached_invoke(understanding_prompt(conversation_history), sections=_history_section(conversation_history))
     return response.content.strip()
 
+def astream_process_understanding(conversation_history: list):
+    """Streams the process understanding summary as text chunks."""
+    return astream_cached(
+        understanding_prompt(conversation_history),
+        sections=_history_section(conversation_history),
+        caller="process_analysis.astream_process_understanding",
+    )
 
-def revise_process_understanding(conversation_history: list, user_input: str, current_understanding: str) -> str:
+def answered_units(conversation_history: list) -> list:
     """
-    Updates the process understanding summary based on user input.
+    Flattens the history into answered (label, question, answer) units in history order:
+    each main answer followed by its follow-ups. A follow-up answered later on an earlier
+    question is therefore inserted before the units of the questions after it, not
+    appended at the end.
+    """
+    units = []
+    for i, item in enumerate(conversation_history, 1):
+        if item.get("answer"):
+            units.append((f"Q{i}", item["question"], item["answer"]))
+        for j, fup in enumerate(item.get("followups", []), 1):
+            if fup.get("answer"):
+                units.append((f"Q{i} follow-up {j}", fup["question"], fup["answer"]))
+    return units
+
+def format_units(units: list) -> str:
+    return "".join(f"{label}: {question}\nA: {answer}\n" for label, question, answer in units)
+
+def understanding_delta_prompt(current_understanding: str, new_units: list) -> str:
+    """
+    Builds the prompt that merges only the new answers into the existing summary.
+    """
+    new_answers = format_units(new_units)
+    prompt = (
+        "You are a SAP consultant. Below is the current bullet-point summary of the client's "
+        "sourcing process:\n\n"
+        f"{current_understanding}\n\n"
+        "New answers from the discovery conversation:\n\n"
+        f"{new_answers}\n"
+        "Merge the new information into the summary. Keep every existing point that is not "
+        "contradicted, update points the new answers change, and add new points where needed. "
+        "Return the complete updated As-Is process understanding as a clear, structured bullet-point summary."
+    )
+    return prompt
+
+def _units_digest(units: list) -> str:
+    return hashlib.sha256(repr(units).encode("utf-8")).hexdigest()
+
+def plan_understanding_update(conversation_history: list, current_understanding: str, state: dict = None) -> tuple:
+    """
+    Decides between a delta merge and a full rebuild. Returns (prompt, sections, new_state),
+    with prompt None when there is nothing new.
+
+    `state` records how many answered units the current understanding covers and their
+    digest. Only units added after those are merged as a delta. A full rebuild happens
+    when there is no understanding yet, when the merged units are no longer a prefix of
+    the current ones (an answer changed, or a late follow-up was inserted among them), or
+    every UNDERSTANDING_REBUILD_EVERY updates, to undo drift.
+    """
+    state = state or {}
+    units = answered_units(conversation_history)
+    merged = state.get("merged", 0)
+    since_rebuild = state.get("since_rebuild", 0)
+
+    # units[merged:] is only the new answers while the merged units are still a prefix
+    prefix_intact = merged <= len(units) and state.get("digest") == _units_digest(units[:merged])
+    stale = not current_understanding or not prefix_intact
+    if not stale and merged == len(units):
+        return None, None, state
+    new_state = {"merged": len(units), "digest": _units_digest(units)}
+    if stale or since_rebuild + 1 >= UNDERSTANDING_REBUILD_EVERY:
+        prompt = understanding_prompt(conversation_history)
+        return prompt, _history_section(conversation_history), {**new_state, "since_rebuild": 0}
+    prompt = understanding_delta_prompt(current_understanding, units[merged:])
+    sections = {"current_understanding": current_understanding, "conversation_history": format_units(units[merged:])}
+    return prompt, sections, {**new_state, "since_rebuild": since_rebuild + 1}
+
+def update_process_understanding(conversation_history: list, current_understanding: str, state: dict = None) -> tuple:
+    """
+    Incrementally updates the process understanding with the entries added since the
+    last update. Returns (understanding, new_state); pass new_state to the next call.
+    """
+    prompt, sections, new_state = plan_understanding_update(conversation_history, current_understanding, state)
+    if prompt is None:
+        return current_understanding, new_state
+    response = cached_invoke(prompt, sections=sections)
+    return response.content.strip(), new_state
+
+async def aupdate_process_understanding(conversation_history: list, current_understanding: str, state: dict = None) -> tuple:
+    """Async variant of update_process_understanding."""
+    prompt, sections, new_state = plan_understanding_update(conversation_history, current_understanding, state)
+    if prompt is None:
+        return current_understanding, new_state
+    response = await acached_invoke(prompt, sections=sections)
+    return response.content.strip(), new_state
+
+
+async def _text_chunks(text: str):
+    yield text
+
+def astream_update_process_understanding(conversation_history: list, current_understanding: str, state: dict = None) -> tuple:
+    """
+    Streaming variant of update_process_understanding. Returns (chunks, new_state): an
+    async iterator of text chunks (the current understanding, unchanged, when there is
+    nothing new) and the state to store once the stream has finished.
+    """
+    prompt, sections, new_state = plan_understanding_update(conversation_history, current_understanding, state)
+    if prompt is None:
+        return _text_chunks(current_understanding), new_state
+    chunks = astream_cached(prompt, sections=sections, caller="process_analysis.astream_update_process_understanding")
+    return chunks, new_state
+
+def understanding_revision_prompt(user_input: str, current_understanding: str) -> str:
+    """
+    Builds the prompt that updates the process understanding summary based on user input.
     """
     correction_prompt = (
         "You are a SAP consultant. Below is the current summary of the client's sourcing process:\n\n"
@@ -33,19 +166,39 @@ def revise_process_understanding(conversation_history: list, user_input: str, cu
         "Please revise the process understanding summary by integrating these changes. "
         "Return the updated summary as a clear bullet-point list."
     )
+    return correction_prompt
 
-    response = llm_instance.invoke(correction_prompt)
-    return response.content.strip()
-
-def generate_process_recommendation(conversation_history: list) -> str:
+def revise_process_understanding(conversation_history: list, user_input: str, current_understanding: str) -> str:
     """
-    Generates two detailed SAP Ariba process recommendation options based on discovery conversation.
+    Updates the process understanding summary based on user input.
     """
+    response = cached_invoke(
+        understanding_revision_prompt(user_input, current_understanding),
+        sections={"current_understanding": current_understanding, "user_input": user_input},
+    )
+    return response.content.strip()
+
+async def arevise_process_understanding(conversation_history: list, user_input: str, current_understanding: str) -> str:
+    """Async variant of revise_process_understanding."""
+    response = await acached_invoke(
+        understanding_revision_prompt(user_input, current_understanding),
+        sections={"current_understanding": current_understanding, "user_input": user_input},
+    )
+    return response.content.strip()
+
+def format_recommendation_history(conversation_history: list) -> str:
     history_str = ""
     for item in conversation_history:
         history_str += f"Q: {item['question']}\nA: {item['answer']}\n"
         for f in item.get("followups", []):
             history_str += f"↳ Follow-up: {f['question']}\nAnswer: {f['answer']}\n"
+    return history_str
+
+def recommendation_prompt(conversation_history: list) -> str:
+    """
+    Builds the prompt for two detailed SAP Ariba process recommendation options.
+    """
+    history_str = format_recommendation_history(conversation_history)
 
     design_prompt = (
         "You are a senior SAP Ariba consultant in a BBP discovery session.\n\n"
@@ -63,13 +216,37 @@ def generate_process_recommendation(conversation_history: list) -> str:
         "Discovery Q&A:\n"
         f"{history_str}"
     )
+    return design_prompt
 
-    response = llm_instance.invoke(design_prompt)
+def generate_process_recommendation(conversation_history: list) -> str:
+    """
+    Generates two detailed SAP Ariba process recommendation options based on discovery conversation.
+    """
+    response = cached_invoke(
+        recommendation_prompt(conversation_history),
+        sections=_history_section(conversation_history, format_recommendation_history),
+    )
     return response.content.strip()
 
-def revise_process_recommendation(user_input: str, current_recommendation: str) -> str:
+async def agenerate_process_recommendation(conversation_history: list) -> str:
+    """Async variant of generate_process_recommendation."""
+    response = await acached_invoke(
+        recommendation_prompt(conversation_history),
+        sections=_history_section(conversation_history, format_recommendation_history),
+    )
+    return response.content.strip()
+
+def astream_process_recommendation(conversation_history: list):
+    """Streams the process recommendation as text chunks."""
+    return astream_cached(
+        recommendation_prompt(conversation_history),
+        sections=_history_section(conversation_history, format_recommendation_history),
+        caller="process_analysis.astream_process_recommendation",
+    )
+
+def recommendation_revision_prompt(user_input: str, current_recommendation: str) -> str:
     """
-    Updates the process recommendation based on user input.
+    Builds the prompt that updates the process recommendation based on user input.
     """
     revision_prompt = (
         "You are a SAP Ariba consultant. Below is the current process recommendation:\n\n"
@@ -78,6 +255,22 @@ def revise_process_recommendation(user_input: str, current_recommendation: str)
         f"{user_input}\n\n"
         "Please regenerate the updated process recommendation, integrating the input, and structure it as a detailed design."
     )
+    return revision_prompt
+
+def revise_process_recommendation(user_input: str, current_recommendation: str) -> str:
+    """
+    Updates the process recommendation based on user input.
+    """
+    response = cached_invoke(
+        recommendation_revision_prompt(user_input, current_recommendation),
+        sections={"current_recommendation": current_recommendation, "user_input": user_input},
+    )
+    return response.content.strip()
 
-    response = llm_instance.invoke(revision_prompt)
+async def arevise_process_recommendation(user_input: str, current_recommendation: str) -> str:
+    """Async variant of revise_process_recommendation."""
+    response = await acached_invoke(
+        recommendation_revision_prompt(user_input, current_recommendation),
+        sections={"current_recommendation": current_recommendation, "user_input": user_input},
+    )
     return response.content.strip()
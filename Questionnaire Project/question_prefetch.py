@@ -0,0 +1,79 @@
+# question_prefetch.py
+
+import asyncio
+from generate_questions import agenerate_suggested_questions
+from vector_utils import build_subprocess_rag_context
+from session_store import cancel_task
+
+
+async def _generate_opening_question(sub_process_name: str, user_choices: dict) -> tuple:
+    rag_context = await asyncio.to_thread(build_subprocess_rag_context, sub_process_name, user_choices)
+    questions = await agenerate_suggested_questions(
+        user_choices=user_choices,
+        sub_process_name=sub_process_name,
+        rag_context=rag_context,
+        conversation_history=[]
+    )
+    return rag_context, questions
+
+
+class QuestionPrefetcher:
+    """
+    Speculatively generates the opening question of the next subprocess while the
+    consultant is still answering the current one. Each session has one slot.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._slots = {}  # session_id -> (sub_process_name, task)
+
+    def start(self, session_id: str, sub_process_name: str, user_choices: dict):
+        """Starts prefetching for a subprocess, replacing any other prefetch of the session."""
+        slot = self._slots.get(session_id)
+        if slot is not None:
+            if slot[0] == sub_process_name:
+                return
+            slot[1].cancel()
+        task = asyncio.create_task(_generate_opening_question(sub_process_name, user_choices))
+        self._slots[session_id] = (sub_process_name, task)
+
+    async def take(self, session_id: str, sub_process_name: str, timeout: float = None):
+        """
+        Returns (rag_context, questions) prefetched for this subprocess, waiting for an
+        in-flight prefetch if needed, or None on a miss.
+        """
+        slot = self._slots.pop(session_id, None)
+        if slot is None or slot[0] != sub_process_name:
+            if slot is not None:
+                slot[1].cancel()
+            self.misses += 1
+            return None
+        try:
+            rag_context, questions = await asyncio.wait_for(slot[1], timeout)
+        except Exception:
+            self.misses += 1
+            return None
+        if not questions or questions[0].startswith("[Error"):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rag_context, questions
+
+    def discard(self, session_id: str):
+        """Drops the session's prefetch. Safe to call from any thread (sessions are evicted in one)."""
+        slot = self._slots.pop(session_id, None)
+        if slot is not None:
+            cancel_task(slot[1])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "in_flight": sum(1 for _, task in self._slots.values() if not task.done()),
+        }
+
+
+question_prefetcher = QuestionPrefetcher()
@@ -1,39 +1,325 @@
 import os
+import json
+import time
+import atexit
+import shutil
+import itertools
+import threading
 import subprocess
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from diagram_cache import DIAGRAM_CACHE_ENABLED, get_diagram_cache
+from flowchart_renderer import render_flowchart_png, UnsupportedDiagram, NATIVE_RENDERER_VERSION
+from metrics import DIAGRAM_RENDERS
 
-def render_mermaid_to_png(mermaid_code: str, output_dir: str, diagram_index: int) -> str:
+RENDERER_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKER_SCRIPT = os.path.join(RENDERER_DIR, "mermaid_worker.mjs")
+
+# "worker" renders every diagram in one long-lived headless browser; "mmdc" spawns the CLI per diagram
+MERMAID_RENDERER = os.getenv("MERMAID_RENDERER", "worker")
+# Plain flowcharts are drawn in Python (flowchart_renderer) and never reach the browser
+MERMAID_NATIVE_FLOWCHARTS = os.getenv("MERMAID_NATIVE_FLOWCHARTS", "1") != "0"
+MERMAID_RENDER_TIMEOUT = float(os.getenv("MERMAID_RENDER_TIMEOUT", 30))
+MERMAID_RENDER_CONCURRENCY = int(os.getenv("MERMAID_RENDER_CONCURRENCY", 4))
+MERMAID_WORKER_START_TIMEOUT = float(os.getenv("MERMAID_WORKER_START_TIMEOUT", 60))
+# After a failed start, diagrams go to mmdc for this long before the worker is tried again
+MERMAID_WORKER_RETRY_SECONDS = float(os.getenv("MERMAID_WORKER_RETRY_SECONDS", 300))
+MMDC_PATH = os.getenv("MMDC_PATH") or shutil.which("mmdc")
+NODE_EXECUTABLE = os.getenv("NODE_EXECUTABLE") or shutil.which("node")
+PUPPETEER_CONFIG_PATH = os.getenv("PUPPETEER_CONFIG_PATH", os.path.join(RENDERER_DIR, "puppeteer-config.json"))
+
+# Passed to both render paths and part of the diagram cache key
+RENDER_OPTIONS = {"format": "png", "width": 800, "height": 600, "scale": 1, "background": "white"}
+# The native renderer draws differently from the browser, so it is part of the cache key too
+DIAGRAM_KEY_OPTIONS = {**RENDER_OPTIONS, "native": NATIVE_RENDERER_VERSION if MERMAID_NATIVE_FLOWCHARTS else None}
+
+# Extra wait on top of the worker's own per-diagram timeout before the worker counts as hung
+WORKER_TIMEOUT_GRACE = 5
+
+
+class MermaidWorkerUnavailable(Exception):
+    """The render worker could not be started; diagrams are rendered with mmdc instead."""
+
+
+def _package_name(directory: str):
+    try:
+        with open(os.path.join(directory, "package.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("name")
+    except (OSError, ValueError):
+        return None
+
+
+def mermaid_cli_dir():
     """
-    Saves the given mermaid code to a .mmd file and renders it to a PNG.
+    Locates the @mermaid-js/mermaid-cli package behind the mmdc executable (a symlink into
+    the package on Linux, an npm shim next to node_modules on Windows), or None.
+    """
+    if os.getenv("MERMAID_CLI_DIR"):
+        return os.getenv("MERMAID_CLI_DIR")
+    if not MMDC_PATH:
+        return None
+    directory = os.path.dirname(os.path.realpath(MMDC_PATH))
+    while True:
+        for candidate in (
+            directory,
+            os.path.join(directory, "node_modules", "@mermaid-js", "mermaid-cli"),
+            os.path.join(directory, "lib", "node_modules", "@mermaid-js", "mermaid-cli"),
+        ):
+            if _package_name(candidate) == "@mermaid-js/mermaid-cli":
+                return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
 
-    Args:
-        mermaid_code (str): The Mermaid.js code block
-        output_dir (str): Directory to store output files
-        diagram_index (int): Diagram number to generate filenames
 
-    Returns:
-        str: Path to the generated PNG file, or None if failed
+class MermaidWorker:
     """
-    try:
-        os.makedirs(output_dir, exist_ok=True)
+    One Node process (mermaid_worker.mjs) holding a headless browser for all diagrams.
+    Requests are JSON lines matched to replies by id; at most `concurrency` diagrams
+    render at once. A worker that dies or stops answering is replaced on the next request;
+    one that fails to start is tried again after MERMAID_WORKER_RETRY_SECONDS.
+    """
+
+    def __init__(self, concurrency: int, timeout: float):
+        self.timeout = timeout
+        self.renders = 0
+        self.restarts = 0
+        self.timeouts = 0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._process = None
+        self._pending = {}
+        self._unavailable = None
+        self._unavailable_at = 0.0
 
-        mmd_path = os.path.join(output_dir, f"diagram_{diagram_index}.mmd")
-        png_path = os.path.join(output_dir, f"diagram_{diagram_index}.png")
+    def _start(self):
+        if not NODE_EXECUTABLE:
+            raise MermaidWorkerUnavailable("node was not found on PATH (set NODE_EXECUTABLE)")
+        env = dict(os.environ)
+        cli_dir = mermaid_cli_dir()
+        if cli_dir:
+            env["MERMAID_CLI_DIR"] = cli_dir
+        if os.path.exists(PUPPETEER_CONFIG_PATH):
+            env["PUPPETEER_CONFIG_PATH"] = PUPPETEER_CONFIG_PATH
 
-        # 👇 Use full path to mmdc.cmd (update if installed elsewhere)
-        mmdc_executable = r"C:\Users\BF493ZC\AppData\Roaming\npm\mmdc.cmd"
+        try:
+            process = subprocess.Popen(
+                [NODE_EXECUTABLE, WORKER_SCRIPT],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                bufsize=1,
+                cwd=RENDERER_DIR,
+                env=env,
+            )
+        except OSError as e:
+            raise MermaidWorkerUnavailable(str(e)) from e
+        ready = Future()
+        pending = {}
+        threading.Thread(
+            target=self._read, args=(process, ready, pending), name="mermaid-worker-reader", daemon=True
+        ).start()
+        try:
+            ready.result(timeout=MERMAID_WORKER_START_TIMEOUT)
+        except Exception as e:
+            process.kill()
+            raise MermaidWorkerUnavailable(str(e) or "timed out waiting for the browser") from e
+        return process, pending
 
-        with open(mmd_path, "w", encoding="utf-8") as f:
-            f.write(mermaid_code)
+    def _read(self, process, ready: Future, pending: dict):
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "ready" in message:
+                if message["ready"]:
+                    ready.set_result(True)
+                else:
+                    ready.set_exception(Exception(message.get("error", "render worker failed to start")))
+                continue
+            future = pending.get(message.get("id"))
+            if future is not None and not future.done():
+                future.set_result(message)
 
-        subprocess.run([
-            mmdc_executable,
-            "-i", mmd_path,
-            "-o", png_path,
-            "--puppeteerConfigFile", "puppeteer-config.json"
-        ], check=True)
+        # The process exited: fail whatever it still owed
+        if not ready.done():
+            ready.set_exception(Exception(f"render worker exited with code {process.wait()}"))
+        for future in list(pending.values()):
+            if not future.done():
+                future.set_exception(Exception("render worker exited"))
 
+    def _stop(self, process):
+        with self._lock:
+            if self._process is process:
+                self._process = None
+                self.restarts += 1
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+    def render(self, mermaid_code: str, png_path: str) -> str:
+        """Renders one diagram to png_path; raises on failure or timeout."""
+        if self._unavailable:
+            if time.monotonic() - self._unavailable_at < MERMAID_WORKER_RETRY_SECONDS:
+                raise self._unavailable
+            self._unavailable = None
+        with self._slots:
+            with self._lock:
+                if self._process is None or self._process.poll() is not None:
+                    if self._process is not None:
+                        # Crashed since the last request
+                        self.restarts += 1
+                    try:
+                        self._process, self._pending = self._start()
+                    except MermaidWorkerUnavailable as e:
+                        self._unavailable, self._unavailable_at = e, time.monotonic()
+                        raise
+                process, pending = self._process, self._pending
+                request_id = next(self._ids)
+                future = pending[request_id] = Future()
+                try:
+                    process.stdin.write(json.dumps({
+                        "id": request_id,
+                        "code": mermaid_code,
+                        "output": os.path.abspath(png_path),
+                        "timeout": int(self.timeout * 1000),
+                        "options": RENDER_OPTIONS,
+                    }) + "\n")
+                    process.stdin.flush()
+                except OSError as e:
+                    pending.pop(request_id, None)
+                    self._process = None
+                    raise Exception(f"render worker is gone: {e}")
+
+            try:
+                result = future.result(timeout=self.timeout + WORKER_TIMEOUT_GRACE)
+            except FutureTimeoutError:
+                # The worker stopped answering altogether; replace it
+                self.timeouts += 1
+                self._stop(process)
+                raise Exception(f"render worker did not answer within {self.timeout:.0f}s")
+            finally:
+                pending.pop(request_id, None)
+
+        if not result.get("ok"):
+            raise Exception(result.get("error", "render failed"))
+        self.renders += 1
         return png_path
 
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=10)
+        except Exception:
+            process.kill()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._process is not None and self._process.poll() is None,
+            "renders": self.renders,
+            "restarts": self.restarts,
+            "timeouts": self.timeouts,
+            "unavailable": str(self._unavailable) if self._unavailable else None,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_mermaid_worker() -> MermaidWorker:
+    worker = MermaidWorker(MERMAID_RENDER_CONCURRENCY, MERMAID_RENDER_TIMEOUT)
+    atexit.register(worker.close)
+    return worker
+
+
+def render_with_mmdc(mmd_path: str, png_path: str):
+    """Renders one .mmd file with a fresh mmdc process (and browser)."""
+    if not MMDC_PATH:
+        raise Exception("mmdc was not found on PATH (npm install -g @mermaid-js/mermaid-cli, or set MMDC_PATH)")
+    command = [
+        MMDC_PATH, "-i", mmd_path, "-o", png_path,
+        "-w", str(RENDER_OPTIONS["width"]), "-H", str(RENDER_OPTIONS["height"]),
+        "-s", str(RENDER_OPTIONS["scale"]), "-b", RENDER_OPTIONS["background"],
+    ]
+    if os.path.exists(PUPPETEER_CONFIG_PATH):
+        command += ["--puppeteerConfigFile", PUPPETEER_CONFIG_PATH]
+    subprocess.run(command, check=True, timeout=MERMAID_RENDER_TIMEOUT)
+
+
+def render_png(mermaid_code: str, mmd_path: str, png_path: str):
+    """
+    Saves the code to mmd_path and renders it to png_path: natively when it is a plain
+    flowchart, otherwise through the worker when available, else with mmdc.
+    """
+    with open(mmd_path, "w", encoding="utf-8") as f:
+        f.write(mermaid_code)
+
+    if MERMAID_NATIVE_FLOWCHARTS:
+        try:
+            render_flowchart_png(mermaid_code, png_path, RENDER_OPTIONS)
+            DIAGRAM_RENDERS.inc(1, "native")
+            return
+        except UnsupportedDiagram:
+            pass
+
+    if MERMAID_RENDERER == "worker":
+        try:
+            get_mermaid_worker().render(mermaid_code, png_path)
+            DIAGRAM_RENDERS.inc(1, "worker")
+            return
+        except MermaidWorkerUnavailable as e:
+            print(f"⚠️ Mermaid render worker unavailable, falling back to mmdc: {e}")
+
+    render_with_mmdc(mmd_path, png_path)
+    DIAGRAM_RENDERS.inc(1, "mmdc")
+
+
+def render_mermaid(mermaid_code: str, output_dir: str, diagram_index: int) -> str:
+    """Same as render_mermaid_to_png, but raises when the diagram cannot be rendered."""
+    if DIAGRAM_CACHE_ENABLED:
+        return get_diagram_cache().get_or_render(mermaid_code, DIAGRAM_KEY_OPTIONS, render_png)
+
+    os.makedirs(output_dir, exist_ok=True)
+    mmd_path = os.path.join(output_dir, f"diagram_{diagram_index}.mmd")
+    png_path = os.path.join(output_dir, f"diagram_{diagram_index}.png")
+    render_png(mermaid_code, mmd_path, png_path)
+    return png_path
+
+
+def render_mermaid_to_png(mermaid_code: str, output_dir: str, diagram_index: int) -> str:
+    """
+    Renders the given mermaid code to a PNG. With the diagram cache enabled the image
+    lives in the cache, addressed by its source and render options, and unchanged
+    diagrams are not rendered again; otherwise it is written to output_dir.
+
+    Args:
+        mermaid_code (str): The Mermaid.js code block
+        output_dir (str): Directory to store output files when the cache is disabled
+        diagram_index (int): Diagram number to generate filenames
+
+    Returns:
+        str: Path to the generated PNG file, or None if failed
+    """
+    try:
+        return render_mermaid(mermaid_code, output_dir, diagram_index)
     except Exception as e:
         print(f"⚠️ Failed to render Mermaid diagram {diagram_index}: {e}")
         return None
+
+
+def render_mermaid_batch(mermaid_codes: list, output_dir: str, render=render_mermaid_to_png) -> list:
+    """
+    Renders several diagrams concurrently (numbered from 1); browser renders share the worker.
+    Returns the PNG paths in input order, None for diagrams that failed.
+    """
+    if not mermaid_codes:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MERMAID_RENDER_CONCURRENCY, len(mermaid_codes))) as pool:
+        return list(pool.map(lambda item: render(item[1], output_dir, item[0]), enumerate(mermaid_codes, 1)))
@@ -23,4 +23,10 @@ class ProcessUnderstandingResponse(BaseModel):
  
 # --- Response schema for process recommendation ---
 class ProcessRecommendationResponse(BaseModel):
-    recommendation: str
\ No newline at end of file
+    recommendation: str
+
+# --- Ranked follow-up candidates with a stop decision ---
+class FollowUpPlan(BaseModel):
+    followups: List[str] = []  # most valuable first
+    stop: bool = False  # True when no follow-up is worth asking
+    reason: Optional[str] = None
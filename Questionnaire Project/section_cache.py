@@ -0,0 +1,29 @@
+# section_cache.py
+#
+# Generated BBP sections keyed by the inputs each section declares in BBP_SECTIONS
+# (generate_bbp.py), so revising one input regenerates only the sections that use it; the
+# rest are reused verbatim. Stored like LLM responses, in a SQLite file of its own.
+
+import os
+import threading
+from llm_cache import LLMResponseCache
+
+BBP_SECTION_CACHE_ENABLED = os.getenv("BBP_SECTION_CACHE_ENABLED", "1") != "0"
+BBP_SECTION_CACHE_PATH = os.getenv("BBP_SECTION_CACHE_PATH", os.path.join("cache", "bbp_sections.sqlite"))
+BBP_SECTION_CACHE_TTL_SECONDS = float(os.getenv("BBP_SECTION_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+BBP_SECTION_CACHE_MAX_ENTRIES = int(os.getenv("BBP_SECTION_CACHE_MAX_ENTRIES", 500))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_section_cache() -> LLMResponseCache:
+    """Returns the process-wide BBP section cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache(
+                BBP_SECTION_CACHE_PATH, BBP_SECTION_CACHE_TTL_SECONDS, BBP_SECTION_CACHE_MAX_ENTRIES,
+                enabled=BBP_SECTION_CACHE_ENABLED,
+            )
+        return _cache
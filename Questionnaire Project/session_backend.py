@@ -0,0 +1,172 @@
+# session_backend.py
+
+import os
+import uuid
+import atexit
+import sqlite3
+import threading
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join("cache", "sessions.sqlite"))
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", 0.5))
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", 100))
+
+# Identifies this worker's writes, so other workers can tell their copy is stale
+PROCESS_ID = uuid.uuid4().hex
+
+
+class SessionBackend:
+    """Interface of a durable store for serialized session state."""
+
+    def load(self, session_id: str):
+        """Returns (state, updated_at) or None."""
+        return None
+
+    def last_write(self, session_id: str):
+        """Returns (writer, updated_at) of the stored state, or None."""
+        return None
+
+    def save_many(self, rows: dict):
+        """Stores {session_id: (state, updated_at)} in one batch."""
+
+    def delete(self, session_id: str):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Session state in a local SQLite file (WAL mode), shared by all workers on the host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, writer TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, session_id: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+    def last_write(self, session_id: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT writer, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+
+    def save_many(self, rows: dict):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions (session_id, state, writer, updated_at) VALUES (?, ?, ?, ?)",
+                [(session_id, state, PROCESS_ID, updated_at) for session_id, (state, updated_at) in rows.items()],
+            )
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+
+class WriteBehindWriter:
+    """
+    Queues session snapshots and writes them from a background thread, in batches every
+    `flush_seconds` (or sooner once `batch_size` sessions are waiting). Repeated saves of
+    one session between flushes collapse into a single write.
+    """
+
+    def __init__(self, backend: SessionBackend, flush_seconds: float, batch_size: int):
+        self.backend = backend
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.writes = 0
+        self.batches = 0
+        self.errors = 0
+        self._pending = {}
+        self._inflight = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def schedule(self, session_id: str, state: str, updated_at: float):
+        with self._cond:
+            self._pending[session_id] = (state, updated_at)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self, session_id: str):
+        """Returns the newest not-yet-written (state, updated_at) of a session, or None."""
+        with self._cond:
+            return self._pending.get(session_id) or self._inflight.get(session_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return
+            try:
+                self.backend.save_many(batch)
+                self.writes += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Failed to persist {len(batch)} session(s): {e}")
+                with self._cond:
+                    # Keep the snapshots for the next flush unless newer ones arrived meanwhile
+                    for session_id, row in batch.items():
+                        self._pending.setdefault(session_id, row)
+            finally:
+                with self._cond:
+                    self._inflight = {}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    break
+                self._cond.wait(self.flush_seconds)
+            self.flush()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = len(self._pending)
+        return {"queued": queued, "writes": self.writes, "batches": self.batches, "errors": self.errors}
+
+
+# Backend name -> zero-argument factory ("memory" keeps sessions in process only)
+SESSION_BACKENDS = {
+    "memory": lambda: None,
+    "sqlite": lambda: SQLiteSessionBackend(SESSION_DB_PATH),
+}
+
+
+def register_session_backend(name: str, factory):
+    """Registers a zero-argument factory returning a SessionBackend."""
+    SESSION_BACKENDS[name] = factory
+
+
+def get_session_backend(name: str = None) -> SessionBackend:
+    name = name or SESSION_BACKEND
+    if name not in SESSION_BACKENDS:
+        raise Exception(f"Unknown session backend '{name}'. Available: {sorted(SESSION_BACKENDS)}")
+    return SESSION_BACKENDS[name]()
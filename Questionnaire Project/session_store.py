@@ -0,0 +1,227 @@
+# session_store.py
+
+import os
+import re
+import copy
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from user_choices import current_user_choices as DEFAULT_USER_CHOICES
+from session_backend import (
+    PROCESS_ID, SESSION_FLUSH_SECONDS, SESSION_FLUSH_BATCH, WriteBehindWriter, get_session_backend
+)
+
+SESSION_HEADER = "X-Session-Id"
+SESSION_COOKIE = "session_id"
+DEFAULT_SESSION_ID = "default"  # used by clients that send no session id
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", 200))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", 4 * 3600))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 256 * 1024 * 1024))
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Derived per request and rebuilt on demand, so never persisted
+TRANSIENT_FIELDS = {"rag_context"}
+
+
+def new_user_choices() -> dict:
+    """Returns a fresh copy of the default user choices for a new session."""
+    return copy.deepcopy(DEFAULT_USER_CHOICES)
+
+
+def serialize_choices(choices: dict) -> str:
+    return json.dumps({k: v for k, v in choices.items() if k not in TRANSIENT_FIELDS}, default=str)
+
+
+def deserialize_choices(state: str) -> dict:
+    """Restores persisted choices on top of the defaults, so newly added fields are present."""
+    choices = new_user_choices()
+    choices.update(json.loads(state))
+    return choices
+
+
+def cancel_task(task: asyncio.Task):
+    """
+    Cancels a task from any thread. Sessions are evicted inside get(), which FastAPI runs
+    in its threadpool, and Task.cancel() may only be called on the task's own loop.
+    """
+    try:
+        task.get_loop().call_soon_threadsafe(task.cancel)
+    except RuntimeError:
+        pass  # the loop is closed, and the task with it
+
+
+def resolve_session_id(header_value: str = None, cookie_value: str = None) -> str:
+    """Picks the session id from the header, then the cookie, falling back to the shared default."""
+    for value in (header_value, cookie_value):
+        if value and _SESSION_ID_RE.match(value):
+            return value
+    return DEFAULT_SESSION_ID
+
+
+class Session:
+    """
+    State of one discovery workshop: its user choices and background analysis tasks.
+    Wrap changes in `async with session:` so requests of a session run one at a time.
+    """
+
+    __slots__ = (
+        "session_id", "choices", "analysis_tasks", "analysis_status", "analysis_version",
+        "lock", "last_access", "size_bytes", "persisted_at", "_store",
+    )
+
+    def __init__(self, session_id: str, store=None, choices: dict = None, persisted_at: float = 0.0):
+        self.session_id = session_id
+        self.choices = choices if choices is not None else new_user_choices()
+        self.analysis_tasks = {}
+        self.analysis_status = {}
+        self.analysis_version = 0
+        self.lock = asyncio.Lock()
+        self.last_access = time.time()
+        self.size_bytes = len(serialize_choices(self.choices))
+        self.persisted_at = persisted_at
+        self._store = store
+
+    async def __aenter__(self):
+        await self.lock.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.last_access = time.time()
+        try:
+            if self._store is not None:
+                self._store.save(self)
+        finally:
+            self.lock.release()
+
+
+class SessionStore:
+    """
+    In-memory sessions in LRU order. Sessions idle for longer than `idle_seconds` are
+    dropped, then the least recently used ones until both `max_sessions` and `max_bytes`
+    hold. Sessions with a request in progress are never evicted.
+
+    Changes are persisted write-behind to `backend`; a session missing from memory (after
+    a restart, an eviction or on another worker) is rehydrated from it on demand, and a
+    cached session is reloaded when another worker has saved a newer version.
+    """
+
+    def __init__(self, max_sessions: int, idle_seconds: float, max_bytes: int, backend=None):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.rehydrations = 0
+        self.backend = backend
+        self.writer = WriteBehindWriter(backend, SESSION_FLUSH_SECONDS, SESSION_FLUSH_BATCH) if backend else None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._evict_callbacks = []
+
+    def on_evict(self, callback):
+        """Registers callback(session_id), called after a session is evicted."""
+        self._evict_callbacks.append(callback)
+
+    def get(self, session_id: str) -> Session:
+        """Returns the session, loading or creating it if needed, and marks it most recently used."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+        elif self.backend is not None and not session.lock.locked():
+            self._refresh(session)
+
+        with self._lock:
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.time()
+            evicted = self._evict_locked(keep=session_id)
+        for stale in evicted:
+            self._close(stale)
+        return session
+
+    def save(self, session: Session):
+        """Queues a snapshot of the session's choices for the backend."""
+        state = serialize_choices(session.choices)
+        session.size_bytes = len(state)
+        if self.writer is not None:
+            session.persisted_at = time.time()
+            self.writer.schedule(session.session_id, state, session.persisted_at)
+
+    def _stored_state(self, session_id: str):
+        row = self.writer.pending(session_id)
+        if row is None:
+            row = self.backend.load(session_id)
+        return row
+
+    def _load(self, session_id: str) -> Session:
+        if self.backend is None:
+            return Session(session_id, store=self)
+        try:
+            row = self._stored_state(session_id)
+        except Exception as e:
+            print(f"⚠️ Could not load session {session_id}: {e}")
+            row = None
+        if row is None:
+            return Session(session_id, store=self)
+        self.rehydrations += 1
+        state, updated_at = row
+        return Session(session_id, store=self, choices=deserialize_choices(state), persisted_at=updated_at)
+
+    def _refresh(self, session: Session):
+        try:
+            last_write = self.backend.last_write(session.session_id)
+            if last_write is None:
+                return
+            writer, updated_at = last_write
+            if writer == PROCESS_ID or updated_at <= session.persisted_at:
+                return
+            state, updated_at = self.backend.load(session.session_id)
+        except Exception as e:
+            print(f"⚠️ Could not refresh session {session.session_id}: {e}")
+            return
+        self.rehydrations += 1
+        session.choices = deserialize_choices(state)
+        session.persisted_at = updated_at
+        session.size_bytes = len(state)
+
+    def _evict_locked(self, keep: str) -> list:
+        now = time.time()
+        evicted = []
+        for session_id, session in list(self._sessions.items()):
+            if session_id != keep and not session.lock.locked() and now - session.last_access > self.idle_seconds:
+                evicted.append(self._sessions.pop(session_id))
+
+        total_bytes = sum(session.size_bytes for session in self._sessions.values())
+        for session_id, session in list(self._sessions.items()):  # least recently used first
+            if len(self._sessions) <= self.max_sessions and total_bytes <= self.max_bytes:
+                break
+            if session_id == keep or session.lock.locked():
+                continue
+            total_bytes -= session.size_bytes
+            evicted.append(self._sessions.pop(session_id))
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def _close(self, session: Session):
+        for task in session.analysis_tasks.values():
+            cancel_task(task)
+        for callback in self._evict_callbacks:
+            callback(session.session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "active": sum(1 for session in self._sessions.values() if session.lock.locked()),
+                "bytes": sum(session.size_bytes for session in self._sessions.values()),
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "rehydrations": self.rehydrations,
+                "persistence": self.writer.stats() if self.writer else None,
+            }
+
+
+session_store = SessionStore(SESSION_MAX_COUNT, SESSION_IDLE_SECONDS, SESSION_MAX_BYTES, get_session_backend())
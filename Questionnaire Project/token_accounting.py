@@ -0,0 +1,141 @@
+# token_accounting.py
+
+import os
+import sys
+import time
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+TOKEN_LEDGER_RECENT_CALLS = int(os.getenv("TOKEN_LEDGER_RECENT_CALLS", 200))
+TOKEN_LEDGER_MAX_SESSIONS = int(os.getenv("TOKEN_LEDGER_MAX_SESSIONS", 1000))
+# Share of the prompt not covered by a named section: persona, instructions, templates
+REMAINDER_SECTION = "persona"
+
+# Set per request by the API so calls roll up per session and endpoint
+current_session_id = contextvars.ContextVar("current_session_id", default=None)
+current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when available, else the usual ~4 characters per token."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def calling_function(depth: int = 2) -> str:
+    """Returns "module.function" of the frame `depth` levels above the caller."""
+    frame = sys._getframe(depth)
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _empty_totals() -> dict:
+    return {
+        "calls": 0,
+        "cached_calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "latency_seconds": 0.0,
+        "sections": {},
+    }
+
+
+def _add(totals: dict, call: dict):
+    totals["calls"] += 1
+    totals["cached_calls"] += call["cached"]
+    totals["input_tokens"] += call["input_tokens"]
+    totals["output_tokens"] += call["output_tokens"]
+    totals["latency_seconds"] = round(totals["latency_seconds"] + call["latency_seconds"], 4)
+    if call["cached"]:
+        return
+    for name, tokens in call["sections"].items():
+        totals["sections"][name] = totals["sections"].get(name, 0) + tokens
+
+
+class TokenLedger:
+    """
+    Records every LLM call (caller, tokens per prompt section, output tokens, latency)
+    and keeps running totals per caller, session and endpoint. Cache hits are counted
+    as calls but kept apart in `cached_calls`; their tokens are not billed.
+    """
+
+    def __init__(self, recent_calls: int, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._recent = deque(maxlen=recent_calls)
+        self._overall = _empty_totals()
+        self._by_caller = {}
+        self._by_endpoint = {}
+        self._by_session = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, caller: str, prompt_text: str, output_text: str, latency_seconds: float,
+               cached: bool = False, sections: dict = None, usage: dict = None):
+        usage = usage or {}
+        section_tokens = {name: count_tokens(text) for name, text in (sections or {}).items()}
+        prompt_tokens = count_tokens(prompt_text)
+        section_tokens[REMAINDER_SECTION] = max(0, prompt_tokens - sum(section_tokens.values()))
+        call = {
+            "caller": caller,
+            "session_id": current_session_id.get(),
+            "endpoint": current_endpoint.get(),
+            "cached": cached,
+            "input_tokens": 0 if cached else usage.get("input_tokens", prompt_tokens),
+            "output_tokens": 0 if cached else usage.get("output_tokens", count_tokens(output_text)),
+            "prompt_tokens": prompt_tokens,
+            "sections": section_tokens,
+            "latency_seconds": round(latency_seconds, 4),
+            "timestamp": time.time(),
+        }
+
+        with self._lock:
+            self._recent.append(call)
+            _add(self._overall, call)
+            _add(self._by_caller.setdefault(caller, _empty_totals()), call)
+            if call["endpoint"]:
+                _add(self._by_endpoint.setdefault(call["endpoint"], _empty_totals()), call)
+            if call["session_id"]:
+                session_totals = self._by_session.pop(call["session_id"], None) or _empty_totals()
+                _add(session_totals, call)
+                self._by_session[call["session_id"]] = session_totals
+                while len(self._by_session) > self.max_sessions:
+                    self._by_session.popitem(last=False)
+
+    def report(self, session_id: str = None, recent: int = 20) -> dict:
+        with self._lock:
+            calls = [c for c in self._recent if session_id is None or c["session_id"] == session_id]
+            report = {
+                "total": self._overall,
+                "by_caller": self._by_caller,
+                "by_endpoint": self._by_endpoint,
+                "by_session": self._by_session if session_id is None else {
+                    session_id: self._by_session.get(session_id, _empty_totals())
+                },
+                "recent_calls": calls[-recent:] if recent else [],
+            }
+            # Deep enough copy that the caller can serialize it outside the lock
+            return {key: _copy(value) for key, value in report.items()}
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+token_ledger = TokenLedger(TOKEN_LEDGER_RECENT_CALLS, TOKEN_LEDGER_MAX_SESSIONS)
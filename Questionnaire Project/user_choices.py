@@ -27,6 +27,7 @@ current_user_choices = {
     "subprocess_states": {},  # <-- new: { "Subprocess A": "completed", "Subprocess B": "incomplete", ... }
     "conversation_history": [],
     "current_process_understanding": "",
+    "understanding_state": {},  # entries merged into the understanding, see process_analysis
     "rag_context": None,
     "current_process_recommendation": ""
 }
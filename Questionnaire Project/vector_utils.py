@@ -1,53 +1,300 @@
 # vector_utils.py
 
 import os
-from langchain_community.vectorstores.chroma import Chroma
-from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from core.models import embeddings_instance
+from langchain_core.documents import Document
+from core.models import get_embeddings, EMBEDDING_PROVIDER
+from embedding_pipeline import ingest_documents
+from parallel_loader import load_files_parallel
+from probing_focus import get_llm_probing_focus
+from vectorstore_registry import get_vectorstore, get_retriever, collection_lock
+from metrics import track_stage
 
 DOCS_FOLDER = "docs"
 VECTOR_DB_PATH = "vectorstore"
+MANIFEST_FILENAME = "ingest_manifest.json"
+MANIFEST_VERSION = 2  # 2: chunk ids include the file path
+PARSE_CACHE_DIR = os.path.join("cache", "parsed_docs")
+SUPPORTED_EXTENSIONS = (".docx", ".pdf")
+SUBPROCESS_RAG_K = 3
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1000))
 
-def load_documents():
-    """Loads .docx and .pdf documents from the docs folder."""
-    loaders = []
-    for filename in os.listdir(DOCS_FOLDER):
-        file_path = os.path.join(DOCS_FOLDER, filename)
-        if filename.endswith(".docx"):
-            loaders.append(Docx2txtLoader(file_path))
-        elif filename.endswith(".pdf"):
-            loaders.append(PyMuPDFLoader(file_path))
-
-    documents = []
-    for loader in loaders:
-        try:
-            documents.extend(loader.load())
-        except Exception as e:
-            print(f"Failed to load {loader}: {e}")
-    return documents
-
-def create_or_load_vectorstore(documents):
-    """Creates or loads the Chroma vectorstore."""
-    if os.path.exists(VECTOR_DB_PATH):
-        return Chroma(persist_directory=VECTOR_DB_PATH, embedding_function=embeddings_instance)
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    split_docs = text_splitter.split_documents(documents)
-
-    vectorstore = Chroma.from_documents(
-        documents=split_docs,
-        embedding=embeddings_instance,
-        persist_directory=VECTOR_DB_PATH
+# Query text -> embedding in LRU order, shared by all sessions in this process
+_query_embeddings = OrderedDict()
+_query_embeddings_lock = threading.Lock()
+
+def list_source_files(docs_folder: str = DOCS_FOLDER) -> list:
+    """Returns the sorted paths of the .docx and .pdf files in the docs folder."""
+    return sorted(
+        os.path.join(docs_folder, filename)
+        for filename in os.listdir(docs_folder)
+        if filename.endswith(SUPPORTED_EXTENSIONS)
     )
-    return vectorstore
+
+def _parse_cache_path(file_path: str) -> str:
+    key = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+    return os.path.join(PARSE_CACHE_DIR, f"{key}.json")
+
+def _read_parse_cache(file_path: str, stat) -> list:
+    """Returns the cached documents of a file, or None if missing or stale."""
+    try:
+        with open(_parse_cache_path(file_path), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in entry["documents"]]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _write_parse_cache(file_path: str, stat, documents: list):
+    cache_path = _parse_cache_path(file_path)
+    entry = {
+        "path": os.path.abspath(file_path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in documents],
+    }
+    try:
+        os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError) as e:
+        print(f"⚠️ Could not cache parsed text for {file_path}: {e}")
+
+def load_documents_by_path(paths: list) -> dict:
+    """
+    Returns {path: documents} in input order, using the persistent parse cache.
+
+    Cache entries are keyed by absolute path and are only reused while the file's
+    mtime and size are unchanged. Cache misses are parsed in parallel across a
+    process pool; files that fail to parse are reported and left out.
+    """
+    stats = {}
+    cached = {}
+    for file_path in paths:
+        try:
+            stats[file_path] = os.stat(file_path)
+        except OSError as e:
+            print(f"Failed to load {file_path}: {e}")
+            continue
+        documents = _read_parse_cache(file_path, stats[file_path])
+        if documents is not None:
+            cached[file_path] = documents
+
+    parsed, failures = load_files_parallel([p for p in stats if p not in cached])
+    for file_path, documents in parsed.items():
+        _write_parse_cache(file_path, stats[file_path], documents)
+    for file_path, error in failures.items():
+        print(f"Failed to load {file_path}: {error}")
+
+    return {p: cached[p] if p in cached else parsed[p] for p in stats if p in cached or p in parsed}
+
+def load_documents(paths: list = None):
+    """Loads .docx and .pdf documents from the docs folder (or only the given paths)."""
+    if paths is None:
+        paths = list_source_files()
+    return [doc for documents in load_documents_by_path(paths).values() for doc in documents]
+
+def hash_file(path: str) -> str:
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id_prefix(path: str, content_hash: str) -> str:
+    """
+    Prefix of a file's chunk ids. It covers the path as well as the content, so two
+    files with identical content get distinct chunks.
+    """
+    return hashlib.sha256(f"{path}\0{content_hash}".encode("utf-8")).hexdigest()
+
+def load_manifest(persist_directory: str = VECTOR_DB_PATH) -> dict:
+    """Reads the ingestion manifest of a vectorstore, or returns None if it has none."""
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable ingestion manifest {manifest_path}: {e}")
+        return None
+
+def save_manifest(manifest: dict, persist_directory: str = VECTOR_DB_PATH):
+    """Atomically writes the ingestion manifest next to the vectorstore."""
+    os.makedirs(persist_directory, exist_ok=True)
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def sync_vectorstore(
+    docs_folder: str = DOCS_FOLDER,
+    persist_directory: str = VECTOR_DB_PATH,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 150,
+    batch_size: int = None,
+):
+    """
+    Brings the vectorstore in line with the docs folder using the ingestion manifest.
+
+    Only added or modified files (by content hash) are split and embedded; the chunks
+    of removed or modified files are deleted. Files whose mtime and size match the
+    manifest are not re-hashed, so an unchanged corpus is checked without reading it.
+    A store without a manifest, or one built with different chunking settings or
+    another embedding provider, is rebuilt from scratch.
+
+    New chunks are embedded through the batched, concurrent embedding pipeline;
+    `batch_size` overrides EMBED_BATCH_SIZE for this run.
+
+    Operates on the shared registry instance under the collection's write lock.
+    Returns a dict of added/modified/removed paths.
+    """
+    vectorstore = get_vectorstore(persist_directory)
+    with collection_lock(persist_directory):
+        return _sync_locked(vectorstore, docs_folder, persist_directory, chunk_size, chunk_overlap, batch_size)
+
+def _sync_locked(vectorstore, docs_folder, persist_directory, chunk_size, chunk_overlap, batch_size):
+    manifest = load_manifest(persist_directory)
+    if (
+        manifest is None
+        or manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("chunk_size") != chunk_size
+        or manifest.get("chunk_overlap") != chunk_overlap
+        or manifest.get("embedding_provider", "ollama") != EMBEDDING_PROVIDER
+    ):
+        existing_ids = vectorstore.get(include=[])["ids"]
+        if existing_ids:
+            vectorstore.delete(ids=existing_ids)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "embedding_provider": EMBEDDING_PROVIDER,
+            "files": {},
+        }
+
+    indexed = manifest["files"]
+    current = {}
+    stats = {}
+    for path in list_source_files(docs_folder):
+        stat = os.stat(path)
+        stats[path] = {"mtime": stat.st_mtime, "size": stat.st_size}
+        entry = indexed.get(path)
+        if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+            current[path] = entry["hash"]
+        else:
+            current[path] = hash_file(path)
+
+    added = [path for path in current if path not in indexed]
+    modified = [path for path in current if path in indexed and indexed[path]["hash"] != current[path]]
+    removed = [path for path in indexed if path not in current]
+    touched = [
+        path for path in current
+        if path in indexed and path not in modified
+        and (indexed[path].get("mtime"), indexed[path].get("size")) != (stats[path]["mtime"], stats[path]["size"])
+    ]
+    for path in touched:
+        indexed[path].update(stats[path])
+
+    stale_ids = []
+    for path in modified + removed:
+        stale_ids.extend(indexed.pop(path)["chunk_ids"])
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    pending_docs, pending_ids = [], []
+    for path, documents in load_documents_by_path(added + modified).items():
+        split_docs = text_splitter.split_documents(documents)
+        prefix = chunk_id_prefix(path, current[path])
+        chunk_ids = [f"{prefix}:{i}" for i in range(len(split_docs))]
+        pending_docs.extend(split_docs)
+        pending_ids.extend(chunk_ids)
+        indexed[path] = {"hash": current[path], "chunk_ids": chunk_ids, **stats[path]}
+    ingest_documents(vectorstore, pending_docs, pending_ids, batch_size=batch_size)
+
+    changes = {"added": added, "modified": modified, "removed": removed}
+    if added or modified or removed or touched:
+        save_manifest(manifest, persist_directory)
+    if added or modified or removed:
+        print(
+            f"🔄 Re-indexed {persist_directory}: {len(added)} added, "
+            f"{len(modified)} modified, {len(removed)} removed"
+        )
+    return changes
+
+def create_or_load_vectorstore():
+    """Returns the shared Chroma vectorstore, incrementally synced with the docs folder."""
+    sync_vectorstore()
+    return get_vectorstore(VECTOR_DB_PATH)
 
 def build_rag_context(k: int = 4, query: str = "SAP Ariba sourcing discovery questions") -> str:
     """
-    Load documents, create/load vectorstore, and return RAG context for a query.
+    Create/load the synced vectorstore and return RAG context for a query.
     """
-    documents = load_documents()
-    vectorstore = create_or_load_vectorstore(documents)
-    retriever = vectorstore.as_retriever(search_type="similarity", k=k)
-    chunks = retriever.invoke(query)
+    create_or_load_vectorstore()
+    retriever = get_retriever(VECTOR_DB_PATH, k=k)
+    with track_stage("retrieval"):
+        chunks = retriever.invoke(query)
+    return "\n\n".join(doc.page_content for doc in chunks)
+
+def subprocess_query(sub_process_name: str, probing_focus: str = "") -> str:
+    """Builds the retrieval query for one subprocess and its probing focus."""
+    query = f"SAP Ariba Sourcing {sub_process_name}: current process, roles, templates, approvals and integrations"
+    if probing_focus:
+        query += f"\n{probing_focus}"
+    return query
+
+def precompute_query_embeddings(queries: list) -> dict:
+    """
+    Embeds all not-yet-cached queries in a single batch call. Returns {query: embedding}
+    for the given queries; the cache keeps the QUERY_EMBEDDING_CACHE_SIZE most recently used.
+    """
+    embeddings = {}
+    with _query_embeddings_lock:
+        for query in dict.fromkeys(queries):
+            if query in _query_embeddings:
+                _query_embeddings.move_to_end(query)
+                embeddings[query] = _query_embeddings[query]
+    missing = [q for q in dict.fromkeys(queries) if q not in embeddings]
+    if not missing:
+        return embeddings
+    vectors = get_embeddings().embed_documents(missing)
+    embeddings.update(zip(missing, vectors))
+    with _query_embeddings_lock:
+        _query_embeddings.update(zip(missing, vectors))
+        while len(_query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+    return embeddings
+
+def precompute_subprocess_embeddings(subprocesses: list, user_choices: dict):
+    """Warms the query embedding cache for every subprocess of an interview."""
+    precompute_query_embeddings([
+        subprocess_query(sp, get_llm_probing_focus(subprocess=sp, user_choices=user_choices))
+        for sp in subprocesses
+    ])
+
+def build_subprocess_rag_context(sub_process_name: str, user_choices: dict, k: int = SUBPROCESS_RAG_K) -> str:
+    """
+    Returns RAG context retrieved for one subprocess and its probing focus.
+
+    The query embedding comes from the process-wide cache, so switching to a
+    precomputed subprocess costs only a vector search.
+    """
+    probing_focus = get_llm_probing_focus(subprocess=sub_process_name, user_choices=user_choices)
+    query = subprocess_query(sub_process_name, probing_focus)
+    embedding = precompute_query_embeddings([query])[query]
+
+    with track_stage("retrieval"):
+        chunks = get_vectorstore(VECTOR_DB_PATH).similarity_search_by_vector(embedding, k=k)
     return "\n\n".join(doc.page_content for doc in chunks)
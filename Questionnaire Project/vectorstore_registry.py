@@ -0,0 +1,115 @@
+# vectorstore_registry.py
+
+import os
+import time
+import threading
+from langchain_community.vectorstores.chroma import Chroma
+from core.models import get_embeddings
+
+# One entry per persisted collection, keyed by absolute persist directory
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _process_rss_bytes() -> int:
+    """Returns the current resident set size of this process (0 if unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except (ImportError, OSError):
+            return 0
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _get_entry(persist_directory: str, embedding_function=None) -> dict:
+    key = os.path.abspath(persist_directory)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is None:
+            rss_before = _process_rss_bytes()
+            start = time.perf_counter()
+            vectorstore = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=embedding_function or get_embeddings(),
+            )
+            entry = {
+                "vectorstore": vectorstore,
+                "lock": threading.RLock(),
+                "retrievers": {},
+                "load_seconds": time.perf_counter() - start,
+                "rss_delta_bytes": max(_process_rss_bytes() - rss_before, 0),
+                "opened_at": time.time(),
+            }
+            _registry[key] = entry
+        return entry
+
+
+def get_vectorstore(persist_directory: str, embedding_function=None):
+    """
+    Returns the process-wide Chroma instance for a persisted collection, opening it on first use.
+    """
+    return _get_entry(persist_directory, embedding_function)["vectorstore"]
+
+
+def collection_lock(persist_directory: str):
+    """
+    Returns the re-entrant lock guarding writes (syncs, re-indexing) to a collection.
+    """
+    return _get_entry(persist_directory)["lock"]
+
+
+def get_retriever(persist_directory: str, search_type: str = "similarity", **search_kwargs):
+    """
+    Returns a shared retriever for a collection. Retrievers hold no per-call state,
+    so one instance per (search_type, search_kwargs) is safely shared across threads.
+    """
+    entry = _get_entry(persist_directory)
+    key = (search_type, tuple(sorted(search_kwargs.items())))
+    with entry["lock"]:
+        retriever = entry["retrievers"].get(key)
+        if retriever is None:
+            retriever = entry["vectorstore"].as_retriever(search_type=search_type, search_kwargs=search_kwargs)
+            entry["retrievers"][key] = retriever
+    return retriever
+
+
+def registry_stats() -> dict:
+    """Returns the open collections with their size, load time and memory footprint."""
+    with _registry_lock:
+        entries = list(_registry.items())
+
+    collections = []
+    for path, entry in entries:
+        try:
+            count = entry["vectorstore"]._collection.count()
+        except Exception:
+            count = None
+        collections.append({
+            "persist_directory": path,
+            "chunks": count,
+            "retrievers": len(entry["retrievers"]),
+            "load_seconds": round(entry["load_seconds"], 4),
+            "rss_delta_bytes": entry["rss_delta_bytes"],
+            "disk_bytes": _directory_size(path),
+            "opened_at": entry["opened_at"],
+        })
+
+    return {
+        "open_collections": len(collections),
+        "process_rss_bytes": _process_rss_bytes(),
+        "collections": collections,
+    }